@@ -1,43 +1,281 @@
-import openai
 import json, re
+import os, math, time, hashlib, threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 import data_manager
+import intraday
+import metrics
+
+openai = data_manager.LazyModule("openai") # 首次创建客户端时才导入
+
+DECISION_CACHE_FILE = os.path.join(data_manager.DATA_DIR, "ai_decision_cache.json")
+DECISION_CACHE_TTL_MINUTES = 60       # 缓存有效期（分钟），另外跨越交易时段即失效
+DECISION_CACHE_PRICE_TOLERANCE = 0.01 # 价格/均线相对变动在此范围内视为未变
+DECISION_CACHE_RSI_STEP = 5           # RSI 量化步长
+_decision_cache_lock = threading.Lock()
+
+VALID_ACTIONS = ("BUY", "SELL", "HOLD", "REDUCE", "CLEAR")
+
+# 各策略的风控线（%），与 Prompt 中的策略描述保持一致；盘中触发器据此判断是否需要立即分析
+STRATEGY_RISK = {
+    "High-Risk/High-Reward": {"stop_loss": -8.0, "take_profit": 20.0, "max_position": 40},
+    "Low-Risk/Low-Yield": {"stop_loss": -5.0, "take_profit": 10.0, "max_position": 15},
+    "Dynamic-Market-Adjusted": {"stop_loss": -6.0, "take_profit": None, "max_position": 30},
+}
+
+def get_strategy_risk(strategy):
+    return STRATEGY_RISK.get(strategy, STRATEGY_RISK["Dynamic-Market-Adjusted"])
+
+AI_TIMEOUT = 60.0   # 单次请求超时（秒）
+AI_MAX_RETRIES = 2  # 连接错误/429/5xx 的重试次数（SDK 内部指数退避）
+
+# 长期复用的客户端：同一组 (base_url, api_key, 超时, 重试) 共用一个 OpenAI 客户端及其 keep-alive 连接池
+# 设置变更后 key 随之变化，旧客户端从注册表移除，下次调用按新设置重建
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_client(settings):
+    api_key = settings.get("api_key")
+    base_url = settings.get("base_url")
+    if not api_key: raise ValueError("未配置 API Key")
+    timeout = float(settings.get("ai_timeout", AI_TIMEOUT))
+    max_retries = int(settings.get("ai_max_retries", AI_MAX_RETRIES))
+    key = (base_url, api_key, timeout, max_retries)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            # 正在使用旧客户端的请求仍持有引用，这里只移出注册表不主动关闭
+            _clients.clear()
+            client = openai.OpenAI(api_key=api_key, base_url=base_url, timeout=timeout, max_retries=max_retries)
+            metrics.incr("llm.client_builds")
+            _clients[key] = client
+        return client
+
+def _build_messages(system_prompt, user_prompt):
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+
+def _parse_json_text(raw_text):
+    """从模型输出中提取 JSON：剥离 Markdown 等无关文本，修正单引号"""
+    json_match = re.search(r'\{.*\}', raw_text.strip(), re.DOTALL)
+    json_str = json_match.group(0) if json_match else raw_text.strip()
+    json_str = json_str.replace("'", '"')
+    return json.loads(json_str)
 
 def call_ai(system_prompt, user_prompt):
     """
     构建 Prompt 并调用 AI
     """
     settings = data_manager.load_settings()
-    api_key = settings.get("api_key")
-    base_url = settings.get("base_url")
-    model_name = settings.get("model_name")
-    
-    if not api_key: raise ValueError("未配置 API Key")
-    client = openai.OpenAI(api_key=api_key, base_url=base_url)
+    client = get_client(settings)
 
-    response = client.chat.completions.create(
-        model=model_name,
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ],
-        temperature=0.3,
-        response_format={"type": "json_object"}
-    )
+    metrics.incr("llm.calls")
+    with metrics.span("llm.call"):
+        response = client.chat.completions.create(
+            model=settings.get("model_name"),
+            messages=_build_messages(system_prompt, user_prompt),
+            temperature=0.3,
+            response_format={"type": "json_object"}
+        )
     
     raw_text = response.choices[0].message.content
     
     # 3. 解析
-    json_match = re.search(r'\{.*\}', raw_text.strip(), re.DOTALL)
-    json_str = json_match.group(0) if json_match else raw_text.strip()
-    json_str = json_str.replace("'", '"')
-    
-    result = json.loads(json_str)
-    return result
+    return _parse_json_text(raw_text)
+
+def validate_analysis_item(item):
+    """校验单条 stocks_analysis 结果，必须包含 symbol 且 action 合法；不合法返回 None"""
+    if not isinstance(item, dict) or not item.get("symbol"):
+        return None
+    action = str(item.get("action", "")).strip().upper()
+    if action not in VALID_ACTIONS:
+        return None
+    item["action"] = action
+    return item
+
+class StreamingAnalysisParser:
+    """
+    增量 JSON 解析器：在流式输出中定位 "stocks_analysis" 数组，
+    每当数组中的一个对象闭合，就立即解析并返回，无需等待整段 JSON 结束
+    """
+    def __init__(self, key="stocks_analysis"):
+        self.key_pattern = re.compile(r'"%s"\s*:\s*\[' % re.escape(key))
+        self.buf = ""
+        self.pos = 0        # 已扫描到的位置
+        self.state = "seek" # seek: 寻找数组起点; array: 数组内; done: 数组已结束
+        self.depth = 0
+        self.in_str = False
+        self.escape = False
+        self.obj_start = None
+
+    def feed(self, text):
+        """追加一段输出，返回本次新闭合且校验通过的对象列表"""
+        self.buf += text
+        items = []
+        if self.state == "seek":
+            m = self.key_pattern.search(self.buf, max(0, self.pos - 64))
+            if not m:
+                self.pos = len(self.buf)
+                return items
+            self.pos = m.end()
+            self.state = "array"
+        if self.state != "array":
+            return items
+
+        buf = self.buf
+        i = self.pos
+        while i < len(buf):
+            c = buf[i]
+            if self.in_str:
+                if self.escape: self.escape = False
+                elif c == '\\': self.escape = True
+                elif c == '"': self.in_str = False
+            elif c == '"':
+                self.in_str = True
+            elif c == '{':
+                if self.depth == 0: self.obj_start = i
+                self.depth += 1
+            elif c == '}':
+                self.depth -= 1
+                if self.depth == 0:
+                    item = self._parse_object(buf[self.obj_start:i + 1])
+                    if item is not None: items.append(item)
+            elif c == ']' and self.depth == 0:
+                self.state = "done"
+                i += 1
+                break
+            i += 1
+        self.pos = i
+        return items
+
+    def _parse_object(self, text):
+        try:
+            obj = json.loads(text)
+        except ValueError:
+            try: obj = json.loads(text.replace("'", '"'))
+            except ValueError: return None
+        return validate_analysis_item(obj)
+
+def call_ai_stream(system_prompt, user_prompt, on_item):
+    """
+    流式调用 AI：stocks_analysis 中每条结果一生成完毕就回调 on_item(item)，
+    全部输出结束后仍返回与 call_ai 相同的完整解析结果
+    """
+    settings = data_manager.load_settings()
+    client = get_client(settings)
+
+    metrics.incr("llm.calls")
+    with metrics.span("llm.stream"):
+        stream = client.chat.completions.create(
+            model=settings.get("model_name"),
+            messages=_build_messages(system_prompt, user_prompt),
+            temperature=0.3,
+            response_format={"type": "json_object"},
+            stream=True
+        )
 
-def generate_batch_prompt(portfolio_summary, stocks_data):
+        parser = StreamingAnalysisParser()
+        chunks = []
+        t0 = time.perf_counter()
+        for chunk in stream:
+            if not chunk.choices: continue
+            delta = chunk.choices[0].delta.content or ""
+            if not delta: continue
+            if not chunks: metrics.observe("llm.first_token", time.perf_counter() - t0)
+            chunks.append(delta)
+            for item in parser.feed(delta):
+                on_item(item)
+
+    return _parse_json_text("".join(chunks))
+
+# --- Prompt 数据编码与 Token 估算 ---
+
+def _format_cell(v):
+    if v is None: return ""
+    if isinstance(v, bool): return str(int(v))
+    if isinstance(v, float):
+        if v != v: return ""
+        return f"{v:.3f}".rstrip('0').rstrip('.')
+    return str(v).replace("\t", " ").replace("\n", " ")
+
+def _flatten_row(row):
+    """嵌套的 dict（如 indicators）展开为同级列；值为 None 的字段不产生列，所有股票都缺失时表头里也没有该列"""
+    flat = {}
+    for k, v in row.items():
+        if v is None:
+            continue
+        if isinstance(v, dict):
+            for sub_k, sub_v in v.items(): flat[sub_k] = sub_v
+        else:
+            flat[k] = v
+    return flat
+
+def encode_stocks(rows, prompt_format="table"):
+    """
+    股票列表编码为 Prompt 文本
+    table: 首行字段名 + 每只股票一行 TSV，字段名只出现一次；json: 原来的缩进 JSON
+    """
+    if not rows: return "[]" if prompt_format == "json" else "(无)"
+    if prompt_format == "json":
+        return json.dumps(rows, ensure_ascii=False, indent=2)
+    flat_rows = [_flatten_row(r) for r in rows]
+    columns = list(dict.fromkeys(k for r in flat_rows for k in r))
+    lines = ["\t".join(columns)]
+    lines += ["\t".join(_format_cell(r.get(c)) for c in columns) for r in flat_rows]
+    return "\n".join(lines)
+
+def _prompt_format(prompt_format=None):
+    if prompt_format is None:
+        prompt_format = data_manager.load_settings().get("ai_prompt_format", "table")
+    return "json" if prompt_format == "json" else "table"
+
+_CJK_RE = re.compile(r'[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]')
+
+def estimate_tokens(text):
+    """粗略估算 Token 数：中日韩字符约 1 Token/字，其余字符约 4 字符/Token"""
+    if not text: return 0
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+def trim_to_token_budget(portfolio_summary, stocks_data, budget, prompt_format=None):
+    """
+    Prompt 估算 Token 超出 budget 时，按优先级从低到高裁掉关注股（持仓股不裁剪）
+    优先级：MACD 金叉 > 无信号 > 死叉，同级时列表靠后的优先裁掉
+    返回 (保留的股票列表, 被裁掉的代码列表)
+    """
+    kept = list(stocks_data)
+    if not budget or budget <= 0: return kept, []
+    prompt_format = _prompt_format(prompt_format)
+
+    def cross(s):
+        try: return int((s.get('indicators') or {}).get('MACD_Cross', 0) or 0)
+        except (TypeError, ValueError): return 0
+    followed = [(i, s) for i, s in enumerate(stocks_data) if s.get('shares', 0) == 0]
+    drop_order = [s for _, s in sorted(followed, key=lambda x: (cross(x[1]), -x[0]))]
+
+    dropped = []
+    while True:
+        system_prompt, user_prompt = generate_batch_prompt(portfolio_summary, kept, prompt_format)
+        excess = estimate_tokens(system_prompt + user_prompt) - budget
+        if excess <= 0 or not drop_order: break
+        # 按单行 Token 估算一次裁掉足够多的股票，再重新核算
+        while excess > 0 and drop_order:
+            s = drop_order.pop(0)
+            kept.remove(s)
+            dropped.append(s.get('symbol'))
+            excess -= estimate_tokens(encode_stocks([s], prompt_format)) // 2 + 1
+    if dropped:
+        print(f"Prompt 超出 Token 预算 {budget}，裁掉关注股: {', '.join(map(str, dropped))}")
+    return kept, dropped
+
+def generate_batch_prompt(portfolio_summary, stocks_data, prompt_format=None):
     """
     仅生成 Prompt 字符串，用于调试或发送
+    prompt_format: table（紧凑表格，默认取设置项 ai_prompt_format）/ json
     """
+    prompt_format = _prompt_format(prompt_format)
     strategy = portfolio_summary.get('strategy', 'Dynamic-Market-Adjusted')
     cash = portfolio_summary.get('cash', 0)
     total_assets = portfolio_summary.get('total_assets', 1)
@@ -50,7 +288,6 @@ def generate_batch_prompt(portfolio_summary, stocks_data):
             "- **止损**: 亏损超过 -8% 坚决止损。\n"
             "- **止盈**: 盈利超过 +20% 后若出现技术面走弱(如MACD死叉)则分批止盈。"
         )
-        max_pos_limit = 40
     elif strategy == "Low-Risk/Low-Yield":
         strategy_desc = (
             "【稳健策略】\n"
@@ -59,7 +296,6 @@ def generate_batch_prompt(portfolio_summary, stocks_data):
             "- **止损**: 亏损超过 -5% 立即止损，严禁扛单。\n"
             "- **止盈**: 盈利 +10% 左右即可考虑逐步落袋，不贪婪。"
         )
-        max_pos_limit = 15
     else:
         strategy_desc = (
             "【动态均衡策略】\n"
@@ -68,18 +304,21 @@ def generate_batch_prompt(portfolio_summary, stocks_data):
             "- **止损**: 亏损 -6% 至 -8% 区间触发止损。\n"
             "- **止盈**: 结合技术指标，若RSI超买(>80)或高位放量滞涨，建议止盈。"
         )
-        max_pos_limit = 30
+
+    max_pos_limit = get_strategy_risk(strategy)["max_position"]
 
     enriched_stocks = []
     followed_stocks = []
     for s in stocks_data:
         if s.get('shares', 0) == 0:
-            followed_stocks.append({
+            item = {
                 'symbol': s.get('symbol'),
                 'name': s.get('name'),
                 'current_price': s.get('current_price', 0.0),
                 'indicators': s.get('indicators'),
-            })
+            }
+            if s.get('trigger'): item['trigger'] = s['trigger']
+            followed_stocks.append(item)
         else:
             cost = s.get('cost_price', 0.0)
             curr = s.get('current_price', 0.0)
@@ -91,11 +330,12 @@ def generate_batch_prompt(portfolio_summary, stocks_data):
             s['pnl_ratio'] = f"{pnl_pct:.2f}%" 
             enriched_stocks.append(s)
 
-    holdings_json = json.dumps(enriched_stocks, ensure_ascii=False, indent=2)
-    if len(followed_stocks) > 0:
-        followed_stocks_json = json.dumps(followed_stocks, ensure_ascii=False, indent=2)
-    else:
-        followed_stocks_json = "[]"
+    holdings_json = encode_stocks(enriched_stocks, prompt_format)
+    followed_stocks_json = encode_stocks(followed_stocks, prompt_format)
+    trigger_note = ""
+    if any(s.get('trigger') for s in stocks_data):
+        trigger_note = "    - `trigger` 字段非空的股票为盘中触发风控/异动条件（止损线、跳空、放量）的股票，必须优先给出明确操作建议\n"
+    data_format_desc = "JSON" if prompt_format == "json" else "TSV 表格（首行为字段名，indicators 已展开为 MA5/RSI/MACD_Cross 等列）"
     
     user_prompt = f"""
     你是一名A股顶级基金经理。[[严格按照要求]]，根据以下账户状态和持仓数据，进行全面的投资决策分析。
@@ -105,7 +345,8 @@ def generate_batch_prompt(portfolio_summary, stocks_data):
     - 总资产: {total_assets} 元
     - 可用现金: {cash} 元
     - 单票仓位上限: {max_pos_limit}% (约为 {total_assets * max_pos_limit / 100:.0f} 元)
-
+    - 股票数据格式: {data_format_desc}
+{trigger_note}
     【当前持仓数据】
     {holdings_json}
 
@@ -115,8 +356,8 @@ def generate_batch_prompt(portfolio_summary, stocks_data):
     【任务要求】
     1. **持仓诊断(核心)**: 必须遍历上述【当前持仓数据】每一只股票。
        - 计算其当前**仓位占比**。必须关注 `pnl_ratio` (盈亏率) 、 `cost_price` (成本价)、`avail_shares` (**当前可交易股数**)、`shares`(持有总股数)。
-       - 结合 JSON 中的 `indicators` (MACD, RSI, MA5) 判断趋势。MACD_Cross=1 为金叉(买入/持有信号)，-1 为死叉(卖出/减仓信号)。
-       - 结合现在股票实时的 `MACDFS` 、 `分时量` 指标判断短期趋势。
+       - 结合数据中的 `indicators` (MACD, RSI, MA5) 判断趋势。MACD_Cross=1 为金叉(买入/持有信号)，-1 为死叉(卖出/减仓信号)。
+       - 结合现在股票实时的 `MACDFS` 、 `分时量` 指标判断短期趋势（`MACDFS_DIF`/`MACDFS_DEA` 为 1 分钟线 MACD，`分时量比`>1 表示近 5 分钟放量；盘中未采集到时无这些字段）。
        - 如果当前仓位超过 {max_pos_limit}%，且盈利或反转趋势不明显，必须建议减仓 (REDUCE)。
        - 如果技术面死叉或严重破位或顶背离，建议卖出 (SELL) 或清仓 (CLEAR)。
        - 严格对照上述策略中的【止损线】，如果亏损幅度触及止损线，除非有极强的反转信号(如底背离金叉)，否则必须建议 SELL/CLEAR。
@@ -128,7 +369,7 @@ def generate_batch_prompt(portfolio_summary, stocks_data):
 
     2. **关注股票诊断(核心)**：必须遍历上述【已跟踪但未持仓的股票】每一只股票。
        - 必须关注 `current_price` (目前股价) 。
-       - 结合 JSON 中的 `indicators` (MACD, RSI, MA5) 判断趋势。MACD_Cross=1 为金叉(买入/持有信号)，-1 为死叉(卖出/减仓信号)。
+       - 结合数据中的 `indicators` (MACD, RSI, MA5) 判断趋势。MACD_Cross=1 为金叉(买入/持有信号)，-1 为死叉(卖出/减仓信号)。
        - 如果技术面金叉或底背离，建议买入 (BUY)。
        - 如果消息面有利好，建议买入 (BUY)。消息面来源包括但不限于公司财报、财经新闻、财经论坛、财经博客、财经网站、财经APP、小红书评价等。
        - 对于 BUY 操作，请给出建议的 **价格区间 (price_range)** (例如: "20.50-20.80")和**目前股价**。
@@ -171,12 +412,13 @@ def generate_batch_prompt(portfolio_summary, stocks_data):
     """
     return "你是一名A股顶级基金经理。请只输出JSON。", user_prompt
 
-def generate_batch_recommand_prompt(stocks_data):
-    stocks_data_jsons = json.dumps(stocks_data, ensure_ascii=False, indent=2)
+def generate_batch_recommand_prompt(stocks_data, prompt_format=None):
+    prompt_format = _prompt_format(prompt_format)
+    stocks_data_jsons = encode_stocks(stocks_data, prompt_format)
     user_prompt = f"""
     根据用户提供的股票数据，遍历每一只股票，对股票进行多维度的深度分析，判断其投资价值，制定短期和长期的交易策略，并计算推荐评分。
 
-    【股票数据】
+    【股票数据】({"JSON" if prompt_format == "json" else "TSV 表格，首行为字段名"})
     {stocks_data_jsons}
 
     【任务要求】
@@ -223,13 +465,151 @@ def generate_batch_recommand_prompt(stocks_data):
     return "你是一位拥有20年A股实战经验的资深基金经理，擅长“基本面选股+技术面择时”的策略。你精通波浪理论、量价关系以及企业财报分析。同时，你是一个严格的数据分析机器人，输出结果必须严格遵循JSON格式。", user_prompt
 
 
-def get_batch_decision(portfolio_summary, stocks_data):
-    system_prompt, user_prompt = generate_batch_prompt(portfolio_summary, stocks_data)
+# --- 决策缓存：账户与指标状态基本未变时复用上次的 AI 决策，节省 Token 与等待时间 ---
+
+def _quantize_price(price, tolerance):
+    """按相对步长对价格分桶（对数刻度），涨跌幅小于 tolerance 的价格大概率落在同一个桶"""
+    try: price = float(price)
+    except (TypeError, ValueError): return None
+    if price <= 0 or tolerance <= 0: return round(price, 2)
+    return round(math.log(price) / math.log1p(tolerance))
+
+def decision_cache_key(portfolio_summary, stocks_data, tolerance, model_name=""):
+    """策略、模型、现金、持仓结构 + 量化后的价格/日线指标 + 触发原因 -> sha256"""
+    stocks = []
+    for s in stocks_data:
+        indicators = {}
+        for k, v in (s.get('indicators') or {}).items():
+            if k in intraday.FEATURE_NAMES: continue # 分时特征逐笔变化，计入后盘中缓存几乎不会命中
+            if k == 'MACD_Cross': indicators[k] = int(v or 0)
+            elif k == 'RSI': indicators[k] = round(float(v or 0) / DECISION_CACHE_RSI_STEP)
+            else: indicators[k] = _quantize_price(v, tolerance)
+        stocks.append({
+            'symbol': s.get('symbol'),
+            'shares': s.get('shares', 0),
+            'avail_shares': s.get('avail_shares', 0),
+            'cost_price': round(float(s.get('cost_price', 0) or 0), 3),
+            'price': _quantize_price(s.get('current_price', 0), tolerance),
+            'indicators': indicators,
+            'trigger': s.get('trigger'),
+        })
+    state = {
+        'strategy': portfolio_summary.get('strategy'),
+        'model': model_name,
+        'cash': _quantize_price(portfolio_summary.get('cash', 0), tolerance),
+        'stocks': sorted(stocks, key=lambda x: str(x['symbol'])),
+    }
+    return hashlib.sha256(json.dumps(state, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+def _current_session(now=None):
+    """当前交易时段标识：跨越上午/下午或交易日时缓存失效"""
+    now = now or datetime.now()
+    return now.strftime("%Y%m%d") + ("AM" if now.hour < 12 else "PM")
+
+def _load_decision_cache():
+    if not os.path.exists(DECISION_CACHE_FILE): return {}
+    try:
+        with open(DECISION_CACHE_FILE, 'r', encoding='utf-8') as f: return json.load(f)
+    except Exception: return {}
+
+def _decision_cache_get(key, ttl_minutes):
+    with _decision_cache_lock:
+        entry = _load_decision_cache().get(key)
+    if not entry: return None
+    if entry.get('session') != _current_session() or time.time() - entry.get('ts', 0) > ttl_minutes * 60:
+        return None
+    return entry.get('result')
+
+def _decision_cache_put(key, result, ttl_minutes):
+    with _decision_cache_lock:
+        cache = _load_decision_cache()
+        now, session = time.time(), _current_session()
+        # 顺带清理过期条目
+        cache = {k: v for k, v in cache.items() if v.get('session') == session and now - v.get('ts', 0) <= ttl_minutes * 60}
+        cache[key] = {'ts': now, 'session': session, 'result': result}
+        with open(DECISION_CACHE_FILE + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump(cache, f, ensure_ascii=False)
+        os.replace(DECISION_CACHE_FILE + ".tmp", DECISION_CACHE_FILE)
+
+def _decide_shard(portfolio_summary, stocks_data, on_item, settings):
+    """单次 AI 调用（带决策缓存），失败时返回空结果"""
+    prompt_format = _prompt_format(settings.get("ai_prompt_format", "table"))
+    stocks_data, _ = trim_to_token_budget(portfolio_summary, stocks_data, int(settings.get("ai_token_budget", 0) or 0), prompt_format)
+    ttl_minutes = float(settings.get("ai_cache_ttl_minutes", DECISION_CACHE_TTL_MINUTES))
+    cache_key = None
+    if ttl_minutes > 0:
+        tolerance = float(settings.get("ai_cache_price_tolerance", DECISION_CACHE_PRICE_TOLERANCE))
+        cache_key = decision_cache_key(portfolio_summary, stocks_data, tolerance, settings.get("model_name", "") + "|" + prompt_format)
+        cached = _decision_cache_get(cache_key, ttl_minutes)
+        if cached is not None:
+            metrics.incr("llm.cache_hits")
+            print("AI 决策缓存命中，跳过 API 调用")
+            if on_item is not None:
+                for item in cached.get("stocks_analysis", []):
+                    item = validate_analysis_item(dict(item))
+                    if item is not None: on_item(item)
+            return cached
+
+    system_prompt, user_prompt = generate_batch_prompt(portfolio_summary, stocks_data, prompt_format)
+    print(f"Prompt 估算 Token: {estimate_tokens(system_prompt + user_prompt)}")
     try:
-        result = call_ai(system_prompt, user_prompt)
+        if on_item is not None:
+            result = call_ai_stream(system_prompt, user_prompt, on_item)
+        else:
+            result = call_ai(system_prompt, user_prompt)
         if "stocks_analysis" not in result:
              if isinstance(result, list): result = {"stocks_analysis": result}
+        if cache_key is not None:
+            _decision_cache_put(cache_key, result, ttl_minutes)
         return result
     except Exception as e:
+        metrics.incr("llm.errors")
         print(f"AI Error: {e}")
-        return {"stocks_analysis": [], "market_opportunities": []}
\ No newline at end of file
+        return {"stocks_analysis": [], "market_opportunities": []}
+
+def split_shards(stocks_data, shard_size):
+    """持仓股优先、按 shard_size 切分；shard_size<=0 表示不分片"""
+    if shard_size <= 0 or len(stocks_data) <= shard_size:
+        return [list(stocks_data)]
+    ordered = [s for s in stocks_data if s.get('shares', 0) != 0] + [s for s in stocks_data if s.get('shares', 0) == 0]
+    return [ordered[i:i + shard_size] for i in range(0, len(ordered), shard_size)]
+
+def _recommendation(op):
+    try: return float(op.get('recommendation', 0) or 0)
+    except (TypeError, ValueError): return 0.0
+
+def merge_shard_results(results):
+    """合并各分片：stocks_analysis 按代码去重拼接，market_opportunities 按代码去重保留推荐度最高者"""
+    analysis, seen = [], set()
+    opportunities = {}
+    for result in results:
+        for item in result.get("stocks_analysis", []) or []:
+            key = str(item.get('symbol'))
+            if key in seen: continue
+            seen.add(key)
+            analysis.append(item)
+        for op in result.get("market_opportunities", []) or []:
+            key = str(op.get('symbol') or op.get('name'))
+            if key not in opportunities or _recommendation(op) > _recommendation(opportunities[key]):
+                opportunities[key] = op
+    ops = sorted(opportunities.values(), key=_recommendation, reverse=True)
+    return {"stocks_analysis": analysis, "market_opportunities": ops}
+
+def get_batch_decision(portfolio_summary, stocks_data, on_item=None):
+    """
+    on_item: 传入时使用流式模式，stocks_analysis 中每条结果生成后立即回调（用于尽早推送信号）
+    Prompt：设置项 ai_prompt_format（table/json）、ai_token_budget（单次请求 Token 上限，0 不限制）
+    决策缓存：设置项 ai_cache_ttl_minutes（0 关闭）、ai_cache_price_tolerance（价格相对变动容忍度）
+    分片：设置项 ai_shard_size（每片股票数，0 不分片）、ai_max_concurrency（并发调用上限）
+         每个分片都携带完整的账户概况（现金、总资产、策略），结果合并后返回
+    """
+    settings = data_manager.load_settings()
+    shards = split_shards(stocks_data, int(settings.get("ai_shard_size", 0) or 0))
+    if len(shards) == 1:
+        return _decide_shard(portfolio_summary, shards[0], on_item, settings)
+
+    workers = max(1, min(int(settings.get("ai_max_concurrency", 4) or 1), len(shards)))
+    print(f"AI 分片调用: {len(stocks_data)} 只股票 -> {len(shards)} 片, 并发 {workers}")
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(lambda shard: _decide_shard(portfolio_summary, shard, on_item, settings), shards))
+    return merge_shard_results(results)
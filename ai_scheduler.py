@@ -13,6 +13,9 @@ try:
     import portfolio
     import data_manager
     import ai_engine 
+    import intraday
+    import strategies
+    import metrics
 except ImportError as e:
     print(f"模块导入错误: {e}")
     sys.exit(1)
@@ -22,13 +25,13 @@ UPDATE_TRY_TIME = 3
 def is_market_open():
     """
     判断当前是否为 A 股交易时间
-    交易时间: 周一到周五 09:30-11:30, 13:00-15:00
-    注意：此处未排除法定节假日，仅做基础时间判断
+    交易时间: 交易日 09:30-11:30, 13:00-15:00
+    交易日按本地缓存的交易所日历判断，已排除周末和法定节假日
     """
     now = datetime.now()
     
-    # 1. 排除周末 (0-4 是周一到周五, 5-6 是周末)
-    if now.weekday() > 4:
+    # 1. 排除非交易日 (周末、法定节假日)
+    if not data_manager.is_trading_day(now):
         return False, False
     
     current_time = now.time()
@@ -53,8 +56,8 @@ def send_notification(title, message):
 class SchedulerUpdateHistoryContext:
     """用于管理调度器跨任务状态的上下文类"""
     def __init__(self):
-        curr_is_market_open, curr_is_market_break = is_market_open()
-        self.was_market_open = curr_is_market_open or curr_is_market_break
+        # 不在构造时查询交易日历（模块导入时会触发 TuShare 导入与联网），由 start_scheduler 启动时按当前时段设置
+        self.was_market_open = False
         self.update_pending = False # 是否有待执行的更新任务
         self.update_thread = None   # 存储更新线程句柄
         self.update_try_time = 0 # 更新尝试次数
@@ -73,6 +76,7 @@ class SchedulerUpdateHistoryContext:
             return
 
         # 定义线程任务函数
+        @metrics.timed("scheduler.update_task")
         def update_task():
             try:
                 # 调用 data_manager 的更新接口
@@ -105,6 +109,7 @@ class SchedulerUpdateHistoryContext:
                 print(f">>> [Scheduler] 更新过程出错: {e}")
                 self.update_pending = True      # ❌ 异常，保持挂起，下次重试
                 wxpusher.send_wechat_msg("每日数据更新过程出错", e)
+        @metrics.timed("scheduler.scan_task")
         def scan_task():
             try:
                 data = portfolio.load_portfolio()
@@ -114,17 +119,23 @@ class SchedulerUpdateHistoryContext:
                 append_followed_cnt = 0
                 append_followed_data = []
 
-                strategys = ["overnight", "limit_up"]
+                strategys = [name for name, _ in strategies.list_strategies(scan_only=True)]
+                # 面板模式：一次载入全市场，同时得到所有策略的结果
+                screen_results = data_manager.screen_stocks_panel(strategys)
+                known = {h['symbol'] for h in holdings}
+                new_followed = []
                 for strategy in strategys:
-                    results = data_manager.screen_stocks_local(strategy)
+                    results = screen_results.get(strategy, [])
                     for h in results[:10]: # 取前10只
                         symbol = h.get('symbol')
-                        existing = next((h for h in holdings if h['symbol'] == symbol), None)
-                        if not existing:
+                        if symbol not in known:
+                            known.add(symbol)
                             name = data_manager.get_stock_name(symbol)
-                            portfolio.upsert_holding(symbol, name, 0, 0, 0, buy_date_str)
+                            new_followed.append((symbol, name, 0, 0, 0, buy_date_str))
                             append_followed_cnt += 1
                             append_followed_data.append(h)
+                if new_followed:
+                    portfolio.upsert_holdings(new_followed) # 一个事务写入全部新增关注
 
                     # if len(results) > 0:
                     #     print(f">>> [Scheduler] 筛选出 {len(results)} 只股票")
@@ -157,7 +168,12 @@ def write_signal_log(message):
     with open(os.path.join(LOG_DIR, f"ai_signals_{today}.txt"), 'a', encoding='utf-8') as f:
         f.write(f"{message}\n")
 
-def gen_holding_stocks_info():
+def gen_holding_stocks_info(symbols=None, triggers=None):
+    """
+    symbols: 只生成这些股票的分析数据（总资产仍按全部持仓计算）；None 表示全部
+    triggers: {symbol: 触发原因}，写入对应股票的 trigger 字段
+    """
+    triggers = triggers or {}
     config = data_manager.load_ai_config()
     strategy = config.get('strategy', 'Dynamic-Market-Adjusted')
     
@@ -173,20 +189,21 @@ def gen_holding_stocks_info():
 
     stocks_data_list = []
     total_val = 0.0
+    # 所有持仓/关注股票的行情合并为一次批量请求
+    quotes = data_manager.get_realtime_quotes([h['symbol'] for h in holdings])
     
     for h in holdings:
         symbol = h['symbol']
-        rt = data_manager.get_realtime_quote(symbol)
+        rt = quotes[symbol]
         price = rt.get('price', 0.0)
         # if price <= 0.01: continue
         
         val = price * h['total_shares']
         total_val += val
+        if symbols is not None and symbol not in symbols: continue
         
         try:
-            hist = data_manager.load_local_history(symbol)
-            indi = data_manager.calculate_indicators(hist)
-            last = indi.iloc[-1] if not indi.empty else {}
+            last = data_manager.get_latest_indicators(symbol)
             
             stocks_data_list.append({
                 "symbol": symbol,
@@ -199,9 +216,11 @@ def gen_holding_stocks_info():
                 "indicators": {
                     "MA5": float(last.get('close', 0)),
                     "RSI": float(last.get('RSI', 0)),
-                    "MACD_Cross": int(last.get('MACD_Cross', 0))
+                    "MACD_Cross": int(last.get('MACD_Cross', 0)),
+                    **intraday.collector.features(symbol) # 分时 MACD/分时量，盘中采集器有数据时才有
                 }
             })
+            if symbol in triggers: stocks_data_list[-1]["trigger"] = triggers[symbol]
         except: continue
 
     summary = {
@@ -211,44 +230,214 @@ def gen_holding_stocks_info():
     }
     return summary, stocks_data_list
 
-def analysising_stocks_job():
-    summary, stocks_data_list = gen_holding_stocks_info()
+def dispatch_stock_signal(d, stocks_data_list, timestamp):
+    """
+    处理单条 stocks_analysis 信号：弹窗通知，看空的关注股从关注列表移除
+    返回需要推送/记录的文本，无操作信号时返回空字符串
+    """
+    output_info = ""
+    act = d.get("action")
+    if act in ["BUY", "SELL", "REDUCE", "CLEAR"]:
+        msg = f"【{act}】{d.get('name', '')}({d.get('symbol')}) 价格区间：{d.get('price_range','')}；操作股数：{d.get('quantity',0)}\n{d.get('reason')}"
+        send_notification(f"AI 信号: {act} {d.get('symbol')}", msg)
+        output_info += f"{timestamp}: {msg}\n"
+        print(f"{timestamp}: {msg}")
+        if act in ["SELL", "REDUCE", "CLEAR"]:
+            if any(h.get('symbol') == d.get('symbol') and float(h.get('shares')) == 0 for h in stocks_data_list):
+                portfolio.delete_holding(d.get('symbol'))
+                msg = f"从关注中移除 {d.get('symbol')}"
+                send_notification(f"AI 信号: {act} {d.get('symbol')}", msg)
+                output_info += f"{timestamp}: {msg}\n"
+                print(f"{timestamp}: {msg}")
+    return output_info
+
+@metrics.timed("ai_job.total")
+def analysising_stocks_job(symbols=None, triggers=None):
+    """
+    symbols: 仅分析指定股票（盘中触发模式），此时不推送市场机会推荐
+    """
+    metrics.incr("ai_job.runs" if symbols is None else "ai_job.triggered_runs")
+    with metrics.span("ai_job.prepare"):
+        summary, stocks_data_list = gen_holding_stocks_info(symbols, triggers) or ({}, [])
     if not stocks_data_list: return
 
     try:
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         print(f"{timestamp}: 正在调用 AI...")
-        res = ai_engine.get_batch_decision(summary, stocks_data_list)
+
+        # 流式模式：模型每输出完一条持仓/关注股分析就立即推送，不等待整个响应结束
+        dispatched = set()
+        dispatch_lock = threading.Lock()
+        def on_item(d):
+            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            try:
+                with dispatch_lock:
+                    dispatched.add(d.get('symbol'))
+                    info = dispatch_stock_signal(d, stocks_data_list, timestamp)
+                    if info:
+                        wxpusher.send_wechat_msg(f"AI 信号: {d.get('action')} {d.get('symbol')}", info)
+                        write_signal_log(f"{info}\n")
+            except Exception as e:
+                print(f"{timestamp}: 信号推送失败: {e}")
+
+        use_stream = data_manager.load_settings().get("ai_stream", True)
+        with metrics.span("ai_job.llm"):
+            res = ai_engine.get_batch_decision(summary, stocks_data_list, on_item=on_item if use_stream else None)
         
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        output_info = ""
-        for d in res.get("stocks_analysis", []):
-            act = d.get("action")
-            if act in ["BUY", "SELL", "REDUCE", "CLEAR"]:
-                msg = f"【{act}】{d.get('name', '')}({d.get('symbol')}) 价格区间：{d.get('price_range','')}；操作股数：{d.get('quantity',0)}\n{d.get('reason')}"
-                send_notification(f"AI 信号: {act} {d.get('symbol')}", msg)
+        with metrics.span("ai_job.dispatch"):
+            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            output_info = ""
+            for d in res.get("stocks_analysis", []):
+                if d.get('symbol') in dispatched: continue # 流式阶段已推送
+                output_info += dispatch_stock_signal(d, stocks_data_list, timestamp)
+            for d in (res.get("market_opportunities", []) if symbols is None else []):
+                msg = f"【推荐({d.get('recommendation',0)})】{d.get('name', '')}({d.get('symbol')}) 价格区间：{d.get('price')}；操作股数：{d.get('quantity',0)}\n{d.get('reason')}"
+                send_notification(f"AI 信号: 推荐 {d.get('symbol')}", msg)
                 output_info += f"{timestamp}: {msg}\n"
                 print(f"{timestamp}: {msg}")
-                if act in ["SELL", "REDUCE", "CLEAR"]:
-                    if any(h.get('symbol') == d.get('symbol') and float(h.get('shares')) == 0 for h in stocks_data_list):
-                        portfolio.delete_holding(d.get('symbol'))
-                        msg = f"{timestamp}: 从关注中移除 {d.get('symbol')}"
-                        send_notification(msg)
-                        output_info += f"{timestamp}: {msg}\n"
-                        print(f"{timestamp}: {msg}")
-        for d in res.get("market_opportunities", []):
-            msg = f"【推荐({d.get('recommendation',0)})】{d.get('name', '')}({d.get('symbol')}) 价格区间：{d.get('price')}；操作股数：{d.get('quantity',0)}\n{d.get('reason')}"
-            send_notification(f"AI 信号: 推荐 {d.get('symbol')}", msg)
-            output_info += f"{timestamp}: {msg}\n"
-            print(f"{timestamp}: {msg}")
-        if len(output_info) > 0: 
-            wxpusher.send_wechat_msg(f"AI 信号: {timestamp}", output_info)
-            write_signal_log(f"{output_info}\n")
+            if len(output_info) > 0: 
+                wxpusher.send_wechat_msg(f"AI 信号: {timestamp}", output_info)
+                write_signal_log(f"{output_info}\n")
         print(f"{timestamp}: AI 决策完成!")
                 
     except Exception as e:
         print(f"执行失败: {e}")
 
+# --- 盘中触发模式：高频轮询行情，本地判断触发条件，仅对触发的股票立即调用 AI ---
+
+class TriggerMonitor:
+    """
+    触发条件：
+      - 持仓盈亏率向下穿越止损线/向上穿越止盈线（ai_engine.STRATEGY_RISK），停留在线外不重复触发
+      - 开盘跳空幅度超过 trigger_gap_pct，每只股票每个交易日只触发一次
+      - 两次采样间的成交速率（量/秒）超过近期平均的 trigger_volume_ratio 倍
+    同一股票触发后进入冷却期（trigger_cooldown_minutes），避免重复调用 AI
+    穿越/跳空事件在 take 真正放行后才登记，被冷却期拦下的会在冷却结束后补发
+    """
+    VOLUME_WARMUP = 5     # 放量判断前至少需要的轮询次数
+    VOLUME_ALPHA = 0.2    # 成交速率的 EWMA 系数
+
+    def __init__(self):
+        self.last_fired = {}   # symbol -> 上次触发时间戳
+        self.last_vol = {}     # symbol -> (日期, 累计成交量, 采样时间戳)
+        self.vol_ewma = {}     # symbol -> (EWMA, 样本数)
+        self.risk_side = {}    # symbol -> 已登记的盈亏区间：-1 止损线下，0 线内，1 止盈线上
+        self.gap_date = {}     # symbol -> 已触发跳空的交易日
+        self.pending = {}      # symbol -> (risk_side, gap_date)，本轮 check 发现、待 take 登记的事件
+        self.lock = threading.Lock()
+
+    def _volume_spike(self, symbol, q, ratio, now):
+        date, vol = q.get('date'), float(q.get('vol', 0) or 0)
+        prev = self.last_vol.get(symbol)
+        self.last_vol[symbol] = (date, vol, now)
+        if prev is None or prev[0] != date:
+            self.vol_ewma.pop(symbol, None) # 新交易日重新统计
+            return False
+        delta, elapsed = vol - prev[1], now - prev[2]
+        if delta <= 0 or elapsed <= 0: return False
+        # 按采样间隔归一化：分析进行中或轮询延迟时，跨多个周期的增量不会被误判为放量
+        rate = delta / elapsed
+        ewma, n = self.vol_ewma.get(symbol, (rate, 0))
+        spike = n >= self.VOLUME_WARMUP and rate > ratio * ewma
+        self.vol_ewma[symbol] = ((1 - self.VOLUME_ALPHA) * ewma + self.VOLUME_ALPHA * rate, n + 1)
+        return spike
+
+    def update_volume(self, quotes, settings, now=None):
+        """每次轮询都调用（包括 AI 分析进行中、跳过触发判断的轮询），返回本次放量的股票集合"""
+        now = time.time() if now is None else now
+        ratio = float(settings.get("trigger_volume_ratio", 3.0))
+        with self.lock:
+            return {symbol for symbol, q in quotes.items() if q and self._volume_spike(symbol, q, ratio, now)}
+
+    def check(self, holdings, quotes, strategy, settings, spikes=()):
+        """返回 {symbol: 触发原因}，spikes 为 update_volume 的结果"""
+        risk = ai_engine.get_strategy_risk(strategy)
+        gap_pct = float(settings.get("trigger_gap_pct", 3.0))
+        fired = {}
+        with self.lock:
+            self.pending = {}
+            for h in holdings:
+                symbol = h['symbol']
+                q = quotes.get(symbol) or {}
+                price = float(q.get('price', 0) or 0)
+                if price <= 0.01: continue
+                reasons = []
+                side, gap_date = None, None
+                if h.get('total_shares', 0) > 0 and h.get('cost', 0) > 0:
+                    pnl = (price - h['cost']) / h['cost'] * 100
+                    side = 0
+                    if pnl <= risk["stop_loss"]: side = -1
+                    elif risk["take_profit"] is not None and pnl >= risk["take_profit"]: side = 1
+                    if side == 0:
+                        self.risk_side[symbol] = 0 # 回到线内，下次穿越可再次触发
+                    elif side != self.risk_side.get(symbol, 0):
+                        reasons.append(f"跌破止损线({pnl:.2f}% <= {risk['stop_loss']}%)" if side < 0
+                                       else f"突破止盈线({pnl:.2f}% >= {risk['take_profit']}%)")
+                    else:
+                        side = None
+                pre_close, open_price = float(q.get('pre_close', 0) or 0), float(q.get('open', 0) or 0)
+                date = q.get('date')
+                if pre_close > 0 and open_price > 0 and self.gap_date.get(symbol) != date:
+                    gap = (open_price - pre_close) / pre_close * 100
+                    if abs(gap) >= gap_pct:
+                        reasons.append(f"跳空{'高' if gap > 0 else '低'}开({gap:+.2f}%)")
+                        gap_date = date
+                if symbol in spikes: reasons.append("盘中放量")
+                if reasons:
+                    fired[symbol] = "；".join(reasons)
+                    self.pending[symbol] = (side or None, gap_date)
+        return fired
+
+    def take(self, fired, cooldown_seconds):
+        """过滤掉冷却期内的股票并登记触发时间"""
+        now = time.time()
+        with self.lock:
+            ready = {s: r for s, r in fired.items() if now - self.last_fired.get(s, 0) >= cooldown_seconds}
+            for s in ready:
+                self.last_fired[s] = now
+                side, gap_date = self.pending.pop(s, (None, None))
+                if side: self.risk_side[s] = side
+                if gap_date is not None: self.gap_date[s] = gap_date
+        if ready: metrics.incr("monitor.triggers", len(ready))
+        return ready
+
+trigger_monitor = TriggerMonitor()
+trigger_job_lock = threading.Lock() # 同一时间只运行一个触发分析，其余触发等下一轮轮询
+
+@metrics.timed("monitor.tick")
+def monitor_job():
+    """
+    高频轮询（默认 5 秒）：行情走共享缓存，不调用 AI，触发后另起线程分析
+    同时把行情喂给分时采集器，收盘后落盘当日分钟线
+    """
+    settings = data_manager.load_settings()
+    curr_is_market_open, curr_is_market_break = is_market_open()
+    if not curr_is_market_open:
+        if not curr_is_market_break and intraday.collector.date:
+            try: intraday.collector.flush()
+            except Exception as e: print(f"分时数据落盘失败: {e}")
+        return
+    try:
+        holdings = portfolio.load_portfolio().get('holdings', [])
+        if not holdings: return
+        quotes = data_manager.get_realtime_quotes([h['symbol'] for h in holdings])
+        intraday.collector.on_quotes(quotes)
+        spikes = trigger_monitor.update_volume(quotes, settings)
+        if not settings.get("trigger_enabled", True) or trigger_job_lock.locked(): return
+        strategy = data_manager.load_ai_config().get('strategy', 'Dynamic-Market-Adjusted')
+        fired = trigger_monitor.check(holdings, quotes, strategy, settings, spikes)
+        fired = trigger_monitor.take(fired, float(settings.get("trigger_cooldown_minutes", 30)) * 60)
+    except Exception as e:
+        print(f"盘中监控失败: {e}")
+        return
+    if not fired: return
+
+    def run():
+        with trigger_job_lock:
+            print(f">>> [Trigger] {', '.join(f'{s}({r})' for s, r in fired.items())}")
+            analysising_stocks_job(symbols=set(fired), triggers=fired)
+    threading.Thread(target=run, daemon=True).start()
+
 def execute_auto_scheduler():
     global scheduler_update_history_ctx
     curr_is_market_open, curr_is_market_break = is_market_open()
@@ -272,11 +461,33 @@ def execute_auto_scheduler():
                 scheduler_update_history_ctx.update_try_time = 0
             scheduler_update_history_ctx.trigger_history_update()
 
+AI_JOB_ID = "ai_job"
+CONFIG_POLL_SECONDS = 15 # 检查配置文件变化的间隔
+
 def start_scheduler():
+    metrics.set_process_name("scheduler")
+    curr_is_market_open, curr_is_market_break = is_market_open()
+    scheduler_update_history_ctx.was_market_open = curr_is_market_open or curr_is_market_break
     config = data_manager.load_ai_config()
     period = config.get('period_minutes', 30)
     scheduler = BlockingScheduler()
-    scheduler.add_job(execute_auto_scheduler, 'interval', minutes=period, start_date=datetime.now())
+    scheduler.add_job(execute_auto_scheduler, 'interval', minutes=period, start_date=datetime.now(), id=AI_JOB_ID)
+
+    # 配置热更新：前端修改周期后直接调整任务间隔，无需重启进程；策略在每次执行时读取，立即生效
+    def on_ai_config_change(new, old):
+        if new.get('strategy') != old.get('strategy'):
+            print(f"策略切换: {old.get('strategy')} -> {new.get('strategy')}")
+        new_period = new.get('period_minutes', 30)
+        if new_period != old.get('period_minutes', 30):
+            scheduler.reschedule_job(AI_JOB_ID, trigger='interval', minutes=new_period)
+            print(f"调度周期调整为 {new_period} 分钟")
+    data_manager.ai_config.subscribe(on_ai_config_change)
+    scheduler.add_job(data_manager.ai_config.poll, 'interval', seconds=CONFIG_POLL_SECONDS)
+
+    # 盘中触发模式：定时任务退化为兜底心跳，风控/异动由高频监控即时触发
+    poll_seconds = data_manager.load_settings().get("trigger_poll_seconds", 5)
+    scheduler.add_job(monitor_job, 'interval', seconds=poll_seconds, max_instances=1, coalesce=True)
+
     print(f"调度器启动，周期 {period} 分钟")
     execute_auto_scheduler()
     try: scheduler.start()
@@ -14,6 +14,8 @@ import data_manager
 import ai_engine
 import ai_scheduler
 import portfolio
+import strategies
+import metrics
 import subprocess
 import signal
 
@@ -58,7 +60,8 @@ if not os.path.exists(data_manager.DATA_DIR):
     os.makedirs(data_manager.DATA_DIR)
 
 # --- 侧边栏 ---
-page = st.sidebar.radio("功能导航", ["📊 市场全景", "🤖 智能决策 & 机会", "📂 数据仓库 & 选股", "💰 资产管理 (T+1)", "⚙️ 系统设置"])
+metrics.set_process_name("app")
+page = st.sidebar.radio("功能导航", ["📊 市场全景", "🤖 智能决策 & 机会", "📂 数据仓库 & 选股", "💰 资产管理 (T+1)", "⚙️ 系统设置", "🩺 性能诊断"])
 
 # --- 辅助函数 ---
 
@@ -224,11 +227,17 @@ elif page == "🤖 智能决策 & 机会":
     if col_btn3.button("🐞 调试 Prompt (不消耗Token)", type="secondary"):
         st.info("正在生成 Prompt 预览...")
         data_manager.save_ai_config(selected_strategy, selected_period)
-        portfolio_summary, mock_stocks = ai_scheduler.gen_ai_executer_info()
+        portfolio_summary, mock_stocks = ai_scheduler.gen_holding_stocks_info() or ({}, [])
         if not mock_stocks:
             pass
         
+        budget = int(data_manager.load_settings().get("ai_token_budget", 0) or 0)
+        mock_stocks, dropped = ai_engine.trim_to_token_budget(portfolio_summary, mock_stocks, budget)
         system_prompt, user_prompt = ai_engine.generate_batch_prompt(portfolio_summary, mock_stocks)
+        tokens = ai_engine.estimate_tokens(system_prompt + user_prompt)
+        st.metric("估算 Token", tokens, help=f"预算: {budget if budget > 0 else '不限制'}")
+        if dropped:
+            st.warning(f"超出 Token 预算，已裁掉关注股: {', '.join(map(str, dropped))}")
         st.text_area("生成的 Prompt 内容", system_prompt + user_prompt, height=400)
 
 # --- 3. 数据仓库管理 (含后台线程) ---
@@ -315,14 +324,15 @@ elif page == "📂 数据仓库 & 选股":
     st.divider()
     st.subheader("本地策略选股 (无需联网)")
     
-    s1, s2 = st.columns(2)
+    # 策略按钮由注册表生成，data/strategies.json 中新增的策略会自动出现
+    strategy_list = strategies.list_strategies()
     strategy = None
-    if s1.button("🌙 一夜持股法"): strategy = "overnight"
-    if s2.button("🚀 打板策略"): strategy = "limit_up"
+    for col, (name, label) in zip(st.columns(len(strategy_list)), strategy_list):
+        if col.button(label, key=f"strategy_{name}"): strategy = name
     
     if strategy:
         with st.spinner("正在筛选本地数据..."):
-            results = data_manager.screen_stocks_local(strategy)
+            results = data_manager.screen_stocks_panel([strategy])[strategy]
             if len(results) > 0:
                 st.write(f"筛选出 {len(results)} 只股票:")
                 df_res = pd.DataFrame(results)
@@ -335,6 +345,7 @@ elif page == "📂 数据仓库 & 选股":
                 if st.button("生成查询prompt"):
                     system_prompt, user_prompt = ai_engine.generate_batch_recommand_prompt(results)
                     st.info("正在生成 Prompt 预览...")
+                    st.caption(f"估算 Token: {ai_engine.estimate_tokens(system_prompt + user_prompt)}")
                     st.text_area("生成的 Prompt 内容", system_prompt + user_prompt, height=400)
             else:
                 st.info("本地数据中未筛选到符合条件的股票，请先确保已下载历史数据。")
@@ -424,9 +435,10 @@ elif page == "💰 资产管理 (T+1)":
     holdings = data.get('holdings', [])
     market_val = 0
     df_data = []
+    quotes = data_manager.get_realtime_quotes([h['symbol'] for h in holdings])
     
     for h in holdings:
-        rt = data_manager.get_realtime_quote(h['symbol'])
+        rt = quotes[h['symbol']]
         price = rt['price']
         
         if price <= 0:
@@ -525,4 +537,60 @@ elif page == "💰 资产管理 (T+1)":
                 portfolio.delete_holding(final_symbol)
                 st.session_state['clear_form_after_submit'] = True
                 st.warning(f"{final_symbol} 已删除")
-                st.rerun()
\ No newline at end of file
+                st.rerun()
+
+# --- 6. 性能诊断 ---
+elif page == "🩺 性能诊断":
+    st.title("性能诊断")
+    st.caption(f"各进程的耗时埋点与计数器（{metrics.METRICS_DIR}，每 {metrics.FLUSH_INTERVAL} 秒落盘），设置项 metrics_enabled 可关闭埋点")
+
+    c1, c2 = st.columns(2)
+    if c1.button("🔄 刷新"):
+        metrics.flush()
+        st.rerun()
+    if c2.button("🗑️ 清空指标"):
+        metrics.reset_all()
+        st.rerun()
+
+    histograms, counters, processes = metrics.load_all()
+    if not histograms and not counters:
+        st.info("暂无指标数据，调度器或页面操作运行后会自动记录。")
+    else:
+        st.subheader("⏱️ 分段耗时 (ms)")
+        rows = []
+        for name, h in sorted(histograms.items()):
+            rows.append({
+                "阶段": name,
+                "次数": h['count'],
+                "平均": round(h['sum'] / h['count'], 1) if h['count'] else 0.0,
+                "P50≤": metrics.percentile(h, 0.5),
+                "P95≤": metrics.percentile(h, 0.95),
+                "最小": round(h['min'], 1),
+                "最大": round(h['max'], 1),
+                "累计(s)": round(h['sum'] / 1000, 2),
+            })
+        st.dataframe(pd.DataFrame(rows), width="stretch", hide_index=True)
+
+        names = sorted(histograms)
+        selected = st.selectbox("延迟分布", names)
+        if selected:
+            h = histograms[selected]
+            labels = [f"≤{b}" for b in metrics.BUCKETS_MS] + [f">{metrics.BUCKETS_MS[-1]}"]
+            st.bar_chart(pd.DataFrame({"次数": h['buckets']}, index=labels))
+
+        st.subheader("📡 行情缓存")
+        hits, misses = counters.get('quote_cache.hits', 0), counters.get('quote_cache.misses', 0)
+        q1, q2, q3, q4 = st.columns(4)
+        q1.metric("命中率", f"{hits / (hits + misses):.1%}" if hits + misses else "-", help=f"命中 {hits} / 未命中 {misses}")
+        q2.metric("合并等待", counters.get('quote_cache.coalesced', 0), help="未命中但等到其他线程/进程抓取结果的代码数")
+        q3.metric("网络请求", counters.get('quote_cache.fetches', 0))
+        q4.metric("请求代码数", hits + misses)
+
+        st.subheader("🔢 计数器")
+        st.dataframe(pd.DataFrame([{"指标": k, "数值": v} for k, v in sorted(counters.items())]), width="stretch", hide_index=True)
+
+        st.subheader("🧩 进程")
+        st.dataframe(pd.DataFrame([{
+            "进程": p['process'], "PID": p['pid'],
+            "更新时间": datetime.fromtimestamp(p['updated']).strftime("%Y-%m-%d %H:%M:%S") if p.get('updated') else "",
+        } for p in processes]), width="stretch", hide_index=True)
@@ -0,0 +1,151 @@
+import sys
+import time
+import numpy as np
+import pandas as pd
+import data_manager
+import strategies
+
+# 向量化回测：在 (symbols × dates) 面板上一次性计算所有交易日的选股信号，不逐日循环
+# 交易规则：信号日 t 收盘后选出 -> t+1 开盘买入 -> 持有 hold_days 个交易日后按收盘价（或开盘价）卖出
+#   - A 股 T+1：买入当日不能卖出，hold_days 至少为 1
+#   - 按 100 股整数倍下单，每笔投入 lot_cash 元，买不起一手的信号跳过
+#   - 开盘即涨停（买不进）的信号跳过
+#   - 费用：佣金双向（最低 5 元）、过户费双向、印花税仅卖出
+# 资金曲线：每笔持仓占用 hold_days+1 个交易日，资金等分为 hold_days+1 份轮动，每日信号等额分配到当日那一份
+
+COMMISSION_RATE = 0.00025
+MIN_COMMISSION = 5.0
+TRANSFER_FEE_RATE = 0.00001
+STAMP_DUTY_RATE = 0.0005
+WARMUP_BARS = 60 # 与选股一致：不足60根K线不参与
+
+def _fees(value, sell):
+    commission = np.maximum(value * COMMISSION_RATE, MIN_COMMISSION)
+    return commission + value * TRANSFER_FEE_RATE + (value * STAMP_DUTY_RATE if sell else 0.0)
+
+def _limit_pct(symbols):
+    """各股涨跌停幅度（%）：双创 20，其余 10"""
+    symbols = np.asarray(symbols, dtype=str)
+    gem = np.char.startswith(symbols, '30') | np.char.startswith(symbols, '68')
+    return np.where(gem, 20.0, 10.0)
+
+def max_drawdown(equity):
+    """最大回撤（正数，如 0.25 表示 25%）"""
+    equity = np.asarray(equity, dtype='float64')
+    if equity.size == 0: return 0.0
+    peak = np.maximum.accumulate(equity)
+    return float(np.max(1 - equity / peak))
+
+def run_backtest(strategy_name, hold_days=1, exit_at="close", bars=5 * 250 + WARMUP_BARS,
+                 lot_cash=100000.0, start=None, end=None, panel=None, ind=None):
+    """
+    回测单个注册策略（见 strategies.py）
+    start/end: 信号日范围（YYYYMMDD 整数），默认面板内全部日期
+    panel/ind: 可传入已载入的面板与指标，多策略/多参数回测时复用
+    返回 dict: summary（统计指标）、trades（逐笔明细 DataFrame）、equity（按日期的资金曲线 Series）
+    """
+    hold_days = max(1, int(hold_days))
+    if panel is None:
+        panel = data_manager.load_history_panel(data_manager.list_local_symbols(), bars=bars)
+    if ind is None:
+        ind = data_manager.calculate_panel_indicators(panel)
+    symbols = panel['symbols']
+    n, bars = panel['close'].shape
+    empty = {'summary': _summarize(pd.DataFrame(), pd.Series(dtype='float64'), strategy_name, hold_days), 'trades': pd.DataFrame(), 'equity': pd.Series(dtype='float64')}
+    span = 1 + hold_days # 信号日到卖出日的间隔
+    if n == 0 or bars <= span:
+        return empty
+
+    # 1. 全部交易日的信号掩码
+    cols = {k: v for k, v in panel.items() if isinstance(v, np.ndarray) and v.ndim == 2}
+    cols.update(ind)
+    mask, _, _ = data_manager._panel_strategy_hits(strategy_name, cols, symbols, with_reason=False)
+    basic_info = data_manager.load_stock_basic_names()
+    names = pd.Series([basic_info.get(s, "") for s in symbols], dtype=object)
+    name_ok = ~names.str.contains("|".join(data_manager.EXCLUDED_NAME_KEYWORDS), regex=True).to_numpy(dtype=bool)
+    # 各K线在该股完整历史中的序号（右对齐面板：最后一列为第 rows 根）
+    hist_idx = panel['rows'][:, None] - (bars - np.arange(bars))[None, :]
+    with np.errstate(invalid='ignore'):
+        ok = mask & name_ok[:, None] & (hist_idx >= WARMUP_BARS - 1) & (panel['vol'] > 0)
+
+    # 2. 信号日 t -> 买入 t+1 开盘 -> 卖出 t+span
+    sig = ok[:, :bars - span]
+    sig_date = panel['trade_date'][:, :bars - span]
+    entry_open = panel['open'][:, 1:bars - span + 1]
+    entry_pre = panel['close'][:, :bars - span]
+    exit_px = panel['close' if exit_at == "close" else 'open'][:, span:]
+    exit_date = panel['trade_date'][:, span:]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        limit_open = (entry_open / entry_pre - 1) * 100 >= _limit_pct(symbols)[:, None] - 0.2
+        valid = sig & (entry_open > 0) & (exit_px > 0) & (exit_date > 0) & ~limit_open
+    if start is not None: valid &= sig_date >= int(start)
+    if end is not None: valid &= sig_date <= int(end)
+
+    rows, cols_idx = np.nonzero(valid)
+    if rows.size == 0:
+        return empty
+
+    # 3. 逐笔（向量化）计算手数、费用与收益
+    buy_px = entry_open[rows, cols_idx]
+    sell_px = exit_px[rows, cols_idx]
+    shares = np.floor(lot_cash / (buy_px * 100)) * 100
+    keep = shares > 0
+    rows, cols_idx, buy_px, sell_px, shares = rows[keep], cols_idx[keep], buy_px[keep], sell_px[keep], shares[keep]
+    buy_value, sell_value = buy_px * shares, sell_px * shares
+    cost = buy_value + _fees(buy_value, sell=False)
+    proceeds = sell_value - _fees(sell_value, sell=True)
+    trades = pd.DataFrame({
+        'symbol': np.asarray(symbols, dtype=object)[rows],
+        'signal_date': sig_date[rows, cols_idx],
+        'exit_date': exit_date[rows, cols_idx],
+        'buy_price': buy_px,
+        'sell_price': sell_px,
+        'shares': shares.astype('int64'),
+        'cost': cost,
+        'pnl': proceeds - cost,
+        'return': proceeds / cost - 1,
+    }).sort_values(['signal_date', 'symbol']).reset_index(drop=True)
+
+    # 4. 资金曲线：当日信号等额分配，组合收益按 1/span 仓位计入
+    daily = trades.groupby('signal_date')[['pnl', 'cost']].sum()
+    basket_ret = daily['pnl'] / daily['cost']
+    equity = (1 + basket_ret / span).cumprod()
+    return {'summary': _summarize(trades, equity, strategy_name, hold_days), 'trades': trades, 'equity': equity}
+
+def _summarize(trades, equity, strategy_name, hold_days):
+    if trades.empty:
+        return {'strategy': strategy_name, 'hold_days': hold_days, 'trades': 0, 'win_rate': 0.0, 'avg_return': 0.0,
+                'total_return': 0.0, 'max_drawdown': 0.0, 'signal_days': 0}
+    return {
+        'strategy': strategy_name,
+        'hold_days': hold_days,
+        'trades': int(len(trades)),
+        'win_rate': round(float((trades['pnl'] > 0).mean()), 4),
+        'avg_return': round(float(trades['return'].mean()), 6),
+        'total_return': round(float(equity.iloc[-1] - 1), 6),
+        'max_drawdown': round(max_drawdown(np.r_[1.0, equity.to_numpy()]), 6),
+        'signal_days': int(len(equity)),
+    }
+
+def backtest_all(strategy_names=None, hold_days=1, **kwargs):
+    """多个策略共用一次面板载入与指标计算，默认回测注册表中的全部策略"""
+    if strategy_names is None:
+        strategy_names = [name for name, _ in strategies.list_strategies()]
+    bars = kwargs.pop('bars', 5 * 250 + WARMUP_BARS)
+    panel = data_manager.load_history_panel(data_manager.list_local_symbols(), bars=bars)
+    ind = data_manager.calculate_panel_indicators(panel)
+    return {name: run_backtest(name, hold_days=hold_days, panel=panel, ind=ind, **kwargs) for name in strategy_names}
+
+if __name__ == "__main__":
+    # 用法: python backtest.py [策略名...] [--hold N]
+    args = sys.argv[1:]
+    hold = 1
+    if "--hold" in args:
+        i = args.index("--hold")
+        hold = int(args[i + 1])
+        args = args[:i] + args[i + 2:]
+    t0 = time.time()
+    results = backtest_all(tuple(args) or None, hold_days=hold)
+    for name, res in results.items():
+        print(res['summary'])
+    print(f"耗时 {time.time() - t0:.2f} 秒")
@@ -0,0 +1,297 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import types
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+# 性能基准：在临时目录中生成可复现的合成 A 股市场（与 TuShare 日线同一列结构），
+# 对数据读取、指标计算、选股、每日增量更新（模拟 pro 客户端，不联网）、持仓存储、Prompt 生成计时，
+# 结果写入 JSON 基线，之后的运行与基线对比，耗时增长超过阈值即标记为回归
+# 另在全新子进程中逐个导入入口模块计时：超过导入预算，或提前加载了应延迟导入的数据源/LLM SDK，同样视为回归
+# 用法:
+#   python benchmark.py --scale small --save            # 生成/覆盖基线
+#   python benchmark.py --scale small                   # 与基线对比
+#   python benchmark.py --symbols 3000 --years 5        # 自定义规模
+#   python benchmark.py --imports-only                  # 只检查模块导入耗时
+
+SCALES = {
+    "small": (500, 1),
+    "medium": (2000, 5),
+    "large": (5000, 10),
+    "xlarge": (10000, 20),
+}
+SRC_DIR = os.path.dirname(os.path.abspath(__file__)) # 项目源码目录，与运行时的当前目录无关
+DEFAULT_BASELINE = os.path.join("data", "benchmark_baseline.json")
+REGRESSION_THRESHOLD = 0.2 # 比基线慢 20% 以上视为回归
+CATCHUP_DAYS = 3           # 合成历史比今天少的交易日数，由增量更新回补
+SAMPLE_SYMBOLS = 200       # 逐股计时项的抽样数量
+IMPORT_MODULES = ["data_manager", "ai_engine", "wxpusher", "ai_scheduler"]
+IMPORT_BUDGET = 1.5        # 单个入口模块的导入耗时上限（秒）
+LAZY_MODULES = ["tushare", "akshare", "baostock", "openai"] # 导入入口模块时不应被加载
+STOCK_NAMES = ["平安银行", "万科A", "浦发银行", "ST康美", "贵州茅台", "宁德时代", "中芯国际", "*ST海航"]
+
+def _board_symbols(n):
+    """按沪深主板/创业板/科创板比例生成代码"""
+    prefixes = ["60", "00", "30", "68"]
+    return [f"{prefixes[i % 4]}{i // 4:04d}" for i in range(n)]
+
+def _ts_code(symbol):
+    return f"{symbol}.SH" if symbol.startswith(("60", "68")) else f"{symbol}.SZ"
+
+def _trading_days(end, count):
+    """截止 end（含）的 count 个工作日，作为合成交易日历"""
+    return pd.bdate_range(end=end, periods=count)
+
+def synth_bars(symbol, dates, rng, start_price=None):
+    """单只股票的合成日线：对数随机游走，偶发涨停，列结构同 TuShare daily"""
+    n = len(dates)
+    limit = 20.0 if symbol.startswith(("30", "68")) else 10.0
+    ret = rng.normal(0.0003, 0.02, n)
+    ret[rng.random(n) < 0.01] = limit / 100 - 0.0001 # 约 1% 的交易日涨停
+    ret = np.clip(ret, -limit / 100, limit / 100)
+    price0 = start_price if start_price is not None else rng.uniform(3, 80)
+    close = np.round(price0 * np.exp(np.cumsum(np.log1p(ret))), 2)
+    pre = np.r_[price0, close[:-1]]
+    op = np.round(pre * (1 + rng.normal(0, 0.005, n)), 2)
+    hi = np.round(np.maximum(op, close) * (1 + np.abs(rng.normal(0, 0.008, n))), 2)
+    lo = np.round(np.minimum(op, close) * (1 - np.abs(rng.normal(0, 0.008, n))), 2)
+    vol = np.round(rng.lognormal(11, 0.6, n) * (1 + 2 * (ret > 0.03)), 0)
+    return pd.DataFrame({
+        'ts_code': _ts_code(symbol),
+        'trade_date': dates.strftime("%Y%m%d").astype('int64'),
+        'open': op, 'high': hi, 'low': lo, 'close': close, 'pre_close': pre,
+        'change': np.round(close - pre, 2), 'pct_chg': np.round((close / pre - 1) * 100, 4),
+        'vol': vol, 'amount': np.round(vol * close / 10, 3),
+    })
+
+def generate_universe(n_symbols, years, seed=42, end=None):
+    """
+    在当前目录的 data/ 下生成合成市场（需先切换到临时目录）
+    历史截止到 end 前 CATCHUP_DAYS 个交易日，留给增量更新回补；返回 (symbols, 全部交易日)
+    """
+    import data_manager
+    end = pd.Timestamp(end or datetime.now().date())
+    all_days = _trading_days(end, years * 250 + CATCHUP_DAYS)
+    hist_days = all_days[:-CATCHUP_DAYS]
+    symbols = _board_symbols(n_symbols)
+    os.makedirs(data_manager.HISTORY_DIR, exist_ok=True)
+    for i, symbol in enumerate(symbols):
+        data_manager.write_history(symbol, synth_bars(symbol, hist_days, np.random.default_rng(seed + i)))
+    pd.DataFrame({'symbol': symbols, 'name': [STOCK_NAMES[i % len(STOCK_NAMES)] for i in range(n_symbols)]}) \
+        .to_csv(os.path.join(data_manager.DATA_DIR, "stock_basic.csv"), index=False)
+    return symbols, all_days
+
+class StubPro:
+    """模拟 TuShare pro 客户端：daily 按交易日返回全市场合成日线，trade_cal 返回工作日日历"""
+    def __init__(self, symbols, days, seed=7):
+        # 预先生成各交易日的全市场数据，计时只包含被测代码本身
+        self.frames = {}
+        for d in days:
+            rng = np.random.default_rng(seed + int(d.strftime("%Y%m%d")))
+            pre = np.round(rng.uniform(3, 80, len(symbols)), 2)
+            close = np.round(pre * (1 + rng.normal(0, 0.02, len(symbols))), 2)
+            vol = np.round(rng.lognormal(11, 0.6, len(symbols)), 0)
+            self.frames[d.strftime("%Y%m%d")] = pd.DataFrame({
+                'ts_code': [_ts_code(s) for s in symbols], 'trade_date': d.strftime("%Y%m%d"),
+                'open': pre, 'high': np.maximum(pre, close), 'low': np.minimum(pre, close), 'close': close,
+                'pre_close': pre, 'change': np.round(close - pre, 2), 'pct_chg': np.round((close / pre - 1) * 100, 4),
+                'vol': vol, 'amount': np.round(vol * close / 10, 3),
+            })
+        self.calls = 0
+
+    def daily(self, trade_date=None, **kwargs):
+        self.calls += 1
+        return self.frames.get(trade_date, pd.DataFrame()).copy()
+
+    def trade_cal(self, exchange='SSE', start_date=None, end_date=None, **kwargs):
+        days = pd.date_range(start_date, end_date)
+        return pd.DataFrame({'cal_date': days.strftime("%Y%m%d"), 'is_open': (days.weekday < 5).astype(int)})
+
+def timeit(func, repeat=1):
+    """返回最快一次的耗时（秒）及最后一次的返回值"""
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+_IMPORT_PROBE = """
+import json, sys, time
+t0 = time.perf_counter()
+import {module}
+print(json.dumps({{"seconds": time.perf_counter() - t0, "loaded": [m for m in {lazy!r} if m in sys.modules]}}))
+"""
+
+def measure_imports(src_dir, modules=IMPORT_MODULES, repeat=3):
+    """
+    在当前目录下为每个模块启动全新的 Python 进程计时 import，取最快一次
+    返回 {模块: {'seconds', 'loaded'(提前加载的 LAZY_MODULES), 'error'}}
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [src_dir, os.environ.get("PYTHONPATH")])))
+    results = {}
+    for module in modules:
+        best, loaded, error = None, [], None
+        for _ in range(repeat):
+            proc = subprocess.run([sys.executable, "-c", _IMPORT_PROBE.format(module=module, lazy=LAZY_MODULES)],
+                                  capture_output=True, text=True, env=env)
+            if proc.returncode != 0:
+                error = (proc.stderr.strip().splitlines() or ["导入失败"])[-1]
+                break
+            data = json.loads(proc.stdout.strip().splitlines()[-1])
+            if best is None or data['seconds'] < best:
+                best = data['seconds']
+            loaded = data['loaded']
+        results[module] = {'seconds': best, 'loaded': loaded, 'error': error}
+    return results
+
+def check_imports(import_results, budget=IMPORT_BUDGET):
+    """打印导入耗时，返回导入失败、超预算或提前加载依赖的模块列表"""
+    failures = []
+    print(f"{'模块导入':<34}{'耗时(s)':>12}  说明")
+    for module, r in import_results.items():
+        if r['error']:
+            failures.append(f"import_{module}")
+            print(f"{module:<34}{'-':>12}  导入失败: {r['error']}")
+            continue
+        notes = []
+        if r['seconds'] > budget: notes.append(f"超出预算 {budget}s")
+        if r['loaded']: notes.append(f"提前加载 {', '.join(r['loaded'])}")
+        if notes: failures.append(f"import_{module}")
+        print(f"{module:<34}{r['seconds']:>12.4f}  {'; '.join(notes) or 'OK'}")
+    return failures
+
+def run_benchmarks(n_symbols, years, seed=42, repeat=3):
+    """在当前目录（应为临时目录）生成市场并逐项计时，返回 {项目: 秒}"""
+    import data_manager, portfolio, ai_engine
+
+    results = {}
+    t0 = time.perf_counter()
+    symbols, all_days = generate_universe(n_symbols, years, seed)
+    results['generate_universe'] = time.perf_counter() - t0
+    sample = symbols[:min(SAMPLE_SYMBOLS, len(symbols))]
+
+    results['load_local_history'], _ = timeit(lambda: [data_manager.load_local_history(s) for s in sample], repeat)
+    history = data_manager.read_history_raw(symbols[0])
+    results['calculate_indicators'], _ = timeit(lambda: data_manager.calculate_indicators(history.copy()), repeat)
+    results['screen_stocks_local'], _ = timeit(lambda: data_manager.screen_stocks_local("overnight"), 1)
+    results['screen_stocks_panel'], _ = timeit(lambda: data_manager.screen_stocks_panel(), 1)
+    panel = data_manager.load_history_panel(symbols)
+    results['calculate_panel_indicators'], _ = timeit(lambda: data_manager.calculate_panel_indicators(panel), repeat)
+
+    # 每日增量更新：把 data_manager.ts 代理背后的模块换成本地模拟客户端
+    # 直接读写 ts.pro_api 会经代理触发真实的 import tushare，导入耗时会混进计时
+    data_manager.save_settings({**data_manager.load_settings(), "tushare_tokens": "bench-token"})
+    stub = StubPro(symbols, all_days[-CATCHUP_DAYS:], seed)
+    stub_module = types.ModuleType("tushare")
+    stub_module.pro_api = lambda *args, **kwargs: stub
+    stub_module.set_token = lambda token: None
+    original_module = data_manager.ts._module
+    object.__setattr__(data_manager.ts, '_module', stub_module)
+    try:
+        results['update_today_data_tushare'], msg = timeit(data_manager.update_today_data_tushare, 1)
+        results['update_today_data_tushare_noop'], _ = timeit(data_manager.update_today_data_tushare, 1)
+        print(f"增量更新: {msg}")
+    finally:
+        object.__setattr__(data_manager.ts, '_module', original_module)
+
+    # 持仓存储
+    buy_date = datetime.now().strftime("%Y-%m-%d")
+    holdings = [(s, "bench", 1000, 500, 10.0, buy_date) for s in sample[:100]]
+    results['portfolio_upsert_holding'], _ = timeit(lambda: [portfolio.upsert_holding(*h) for h in holdings], 1)
+    results['portfolio_upsert_holdings'], _ = timeit(lambda: portfolio.upsert_holdings(holdings), repeat)
+    results['portfolio_load_portfolio'], data = timeit(portfolio.load_portfolio, repeat)
+
+    # Prompt 生成（持仓 + 关注股）
+    summary = {"cash": 100000.0, "total_assets": 1000000.0, "strategy": "Dynamic-Market-Adjusted"}
+    stocks = [{"symbol": h['symbol'], "name": h['name'], "current_price": 10.5, "cost_price": h['cost'],
+               "shares": h['total_shares'] if i % 2 else 0, "market_value": 10500.0, "avail_shares": h['avail_shares'],
+               "indicators": {"MA5": 10.2, "RSI": 55.0, "MACD_Cross": 1}} for i, h in enumerate(data['holdings'])]
+    for fmt in ("json", "table"):
+        results[f'generate_batch_prompt_{fmt}'], _ = timeit(lambda: ai_engine.generate_batch_prompt(summary, [dict(s) for s in stocks], fmt), repeat)
+    return {k: round(v, 6) for k, v in results.items()}
+
+def compare(results, baseline, threshold=REGRESSION_THRESHOLD):
+    """打印与基线的对比，返回回归项列表"""
+    regressions = []
+    print(f"{'项目':<34}{'基线(s)':>12}{'本次(s)':>12}{'变化':>10}")
+    for name, value in results.items():
+        base = baseline.get(name)
+        if not base:
+            print(f"{name:<34}{'-':>12}{value:>12.4f}{'新增':>10}")
+            continue
+        change = value / base - 1
+        flag = " <-- 回归" if change > threshold else ""
+        if flag: regressions.append(name)
+        print(f"{name:<34}{base:>12.4f}{value:>12.4f}{change:>+10.1%}{flag}")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SmartQuant 性能基准")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small")
+    parser.add_argument("--symbols", type=int, help="股票数量（覆盖 --scale）")
+    parser.add_argument("--years", type=int, help="历史年数（覆盖 --scale）")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save", action="store_true", help="把本次结果写为基线")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    parser.add_argument("--import-budget", type=float, default=IMPORT_BUDGET, help="单个模块导入耗时上限（秒）")
+    parser.add_argument("--imports-only", action="store_true", help="只检查模块导入耗时")
+    args = parser.parse_args(argv)
+
+    n_symbols, years = SCALES[args.scale]
+    n_symbols, years = args.symbols or n_symbols, args.years or years
+    baseline_path = os.path.abspath(args.baseline)
+    key = f"{n_symbols}x{years}y"
+
+    # 所有数据路径都是相对 data/ 的，切换到临时目录后再导入项目模块，避免污染真实数据
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="smartquant_bench_")
+    sys.path.insert(0, SRC_DIR)
+    os.chdir(workdir)
+    try:
+        import_results = measure_imports(SRC_DIR, repeat=args.repeat)
+        import_failures = check_imports(import_results, args.import_budget)
+        if args.imports_only:
+            return 1 if import_failures else 0
+        print(f"生成合成市场 {n_symbols} 只股票 × {years} 年，目录 {workdir}")
+        results = run_benchmarks(n_symbols, years, args.seed, args.repeat)
+        results.update({f"import_{m}": round(r['seconds'], 6) for m, r in import_results.items() if not r['error']})
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    baselines = {}
+    if os.path.exists(baseline_path):
+        with open(baseline_path, 'r', encoding='utf-8') as f:
+            baselines = json.load(f)
+    regressions = compare(results, baselines.get(key, {}).get("results", {}), args.threshold)
+    regressions += [name for name in import_failures if name not in regressions]
+
+    if args.save:
+        os.makedirs(os.path.dirname(baseline_path), exist_ok=True)
+        baselines[key] = {
+            "created": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "results": results,
+        }
+        with open(baseline_path, 'w', encoding='utf-8') as f:
+            json.dump(baselines, f, indent=4, ensure_ascii=False)
+        print(f"基线已保存: {baseline_path} [{key}]")
+    if regressions:
+        print(f"发现 {len(regressions)} 项性能回归: {', '.join(regressions)}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,87 @@
+import json
+import os
+import threading
+
+# 进程内配置服务：缓存解析后的 JSON 配置，文件 mtime/size 变化时才重新读取
+# 配置变更（本进程保存或其他进程改写文件）时通知订阅者，用于调度器热更新周期/策略
+
+class JsonConfig:
+    def __init__(self, path, defaults=None):
+        self.path = path
+        self.defaults = dict(defaults or {})
+        self._lock = threading.RLock()
+        self._stamp = None  # (mtime_ns, size)，文件不存在时为 None
+        self._data = None
+        self._subscribers = []
+
+    def _file_stamp(self):
+        try:
+            st = os.stat(self.path)
+            return (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    def _reload(self, stamp):
+        data = dict(self.defaults)
+        if stamp is not None:
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data.update(json.load(f))
+            except (OSError, ValueError) as e:
+                # 文件正被其他进程写入或内容损坏：保留旧缓存，下次再试
+                print(f"读取配置失败 {self.path}: {e}")
+                if self._data is not None: return None
+        old, self._data, self._stamp = self._data, data, stamp
+        return old
+
+    def _refresh(self):
+        """检查文件是否变化，变化则重载并返回 (旧配置, 新配置)，否则返回 None"""
+        with self._lock:
+            stamp = self._file_stamp()
+            if self._data is not None and stamp == self._stamp:
+                return None
+            first = self._data is None
+            old = self._reload(stamp)
+            if first or old is None or old == self._data:
+                return None
+            return old, dict(self._data)
+
+    def _notify(self, change):
+        if change is None: return
+        old, new = change
+        for callback in list(self._subscribers):
+            try: callback(new, old)
+            except Exception as e: print(f"配置变更回调失败: {e}")
+
+    def get(self):
+        """返回配置副本，未变化时不读文件"""
+        change = self._refresh()
+        self._notify(change)
+        with self._lock:
+            return dict(self._data)
+
+    def save(self, data):
+        """原子写入并立即刷新缓存、通知订阅者"""
+        folder = os.path.dirname(self.path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        tmp = self.path + ".tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=4, ensure_ascii=False)
+        os.replace(tmp, self.path)
+        self._notify(self._refresh())
+
+    def poll(self):
+        """供定时任务调用：检测其他进程对配置文件的修改"""
+        self._notify(self._refresh())
+
+    def subscribe(self, callback):
+        """callback(new, old)：配置内容变化时调用"""
+        with self._lock:
+            self._subscribers.append(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
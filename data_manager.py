@@ -1,19 +1,63 @@
 import pandas as pd
 import numpy as np
 import os
-from datetime import datetime
+import sys
+from datetime import datetime, timedelta, time as dtime
 import time
 import requests
 import json
+import re
 import shutil
-import tushare as ts
-import akshare as ak
-import baostock as bs
+import queue
+import threading
+import functools
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import importlib.util
+import indicator_engine
+import indicator_kernels
+import quote_cache
+import config_service
+import strategies
+import metrics
+
+class LazyModule:
+    """
+    模块代理：首次访问属性时才真正导入
+    数据源 SDK（尤其 akshare）导入很慢，只用新浪行情的进程（调度器、推送、界面启动、多进程选股的子进程）不必加载
+    """
+    def __init__(self, name):
+        object.__setattr__(self, '_name', name)
+        object.__setattr__(self, '_module', None)
+
+    def _load(self):
+        module = self._module
+        if module is None:
+            with metrics.span(f"import.{self._name}"):
+                module = importlib.import_module(self._name)
+            object.__setattr__(self, '_module', module)
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __repr__(self):
+        return f"<LazyModule {self._name} ({'loaded' if self._module is not None else 'not loaded'})>"
+
+ts = LazyModule("tushare")
+ak = LazyModule("akshare")
+bs = LazyModule("baostock")
+pq = LazyModule("pyarrow.parquet")
 
 # --- 全局配置 ---
 DATA_DIR = "data"
 HISTORY_DIR = os.path.join(DATA_DIR, "history")
 SETTINGS_FILE = os.path.join(DATA_DIR, "settings.json")
+TRADE_CAL_FILE = os.path.join(DATA_DIR, "trade_cal.csv") # 交易日历缓存
+MANIFEST_FILE = os.path.join(DATA_DIR, "history_manifest.json") # 全量初始化断点清单
+MANIFEST_FLUSH_EVERY = 50
 
 # 完整的模型列表
 MODEL_PROVIDERS = {
@@ -34,6 +78,35 @@ MODEL_PROVIDERS = {
 }
 
 MAX_TRY_TIMES = 60
+# 每个 TuShare Token 每分钟调用次数，按积分档位在设置项 tushare_rate_per_min 中调整，触发限频后会自动下调
+TUSHARE_RATE_PER_MIN = 200
+# 每日增量更新最多回补的自然日数
+UPDATE_CATCHUP_DAYS = 30
+
+# A股交易时段
+TRADING_SESSIONS = [(dtime(9, 30), dtime(11, 30)), (dtime(13, 0), dtime(15, 0))]
+_trade_calendar = None
+_trade_calendar_checked = None # 最近一次尝试刷新日历的日期
+
+# 新浪实时行情
+SINA_QUOTE_URL = "http://hq.sinajs.cn/list="
+SINA_BATCH_SIZE = 800 # 单次 list= 请求合并的代码上限
+_sina_session = None
+_quote_cache = quote_cache.QuoteCache()
+
+# 历史数据存储格式：优先使用列式 Parquet（需 pyarrow），缺失时回退到 CSV
+HISTORY_FORMAT = "parquet" if importlib.util.find_spec("pyarrow") else "csv"
+# 价格类字段统一为 float32，成交量/额保留 float64 避免精度损失
+PRICE_COLUMNS = ['open', 'high', 'low', 'close', 'pre_close', 'change', 'pct_chg']
+VOLUME_COLUMNS = ['vol', 'amount']
+
+# 选股名称过滤关键字
+EXCLUDED_NAME_KEYWORDS = ["ST", "退市", "B股", "北证"]
+# 面板模式载入的最近K线数：需远大于 EMA(26) 的记忆长度，使截断后的 MACD 与全量计算一致
+PANEL_BARS = 250
+PANEL_FIELDS = ['open', 'high', 'low', 'close', 'pct_chg', 'vol']
+# map_universe 每个进程任务处理的股票数
+MAP_CHUNK_SIZE = 64
 
 if not os.path.exists(HISTORY_DIR):
     os.makedirs(HISTORY_DIR)
@@ -41,48 +114,82 @@ if not os.path.exists(HISTORY_DIR):
 DATA_DIR = "data"
 CONFIG_FILE = f"{DATA_DIR}/ai_config.json"
 
+# 配置缓存：文件未变化时不重复解析，其他进程（Streamlit/调度器）改写后自动重载
+ai_config = config_service.JsonConfig(CONFIG_FILE, {"strategy": "Dynamic-Market-Adjusted", "period_minutes": 10})
+settings_config = config_service.JsonConfig(SETTINGS_FILE, {
+    "tushare_tokens": "", 
+    "selected_provider": "DeepSeek",
+    "api_key": "",
+    "model_name": "deepseek-chat",
+    "base_url": "https://api.deepseek.com",
+    "market_data_source": "sina",
+    "wxpusher_token": "",
+    "wxpusher_uids": "",
+    "quote_cache_ttl": quote_cache.DEFAULT_TTL,
+    "tushare_rate_per_min": TUSHARE_RATE_PER_MIN,
+    "ai_stream": True,
+    "ai_cache_ttl_minutes": 60,
+    "ai_cache_price_tolerance": 0.01,
+    "ai_shard_size": 0,
+    "ai_max_concurrency": 4,
+    "ai_prompt_format": "table",
+    "ai_token_budget": 0,
+    "ai_timeout": 60,
+    "ai_max_retries": 2,
+    "trigger_enabled": True,
+    "trigger_poll_seconds": 5,
+    "trigger_cooldown_minutes": 30,
+    "trigger_gap_pct": 3.0,
+    "trigger_volume_ratio": 3.0,
+    "metrics_enabled": True,
+})
+
+# 性能埋点开关随设置项 metrics_enabled 热更新
+metrics.set_enabled(settings_config.get().get("metrics_enabled", True))
+settings_config.subscribe(lambda new, old: metrics.set_enabled(new.get("metrics_enabled", True)))
+
 def load_ai_config():
-    if not os.path.exists(CONFIG_FILE): return {"strategy": "Dynamic-Market-Adjusted", "period_minutes": 10}
-    with open(CONFIG_FILE, 'r', encoding='utf-8') as f: return json.load(f)
+    return ai_config.get()
 
 def save_ai_config(strategy, period_minutes):
-    if not os.path.exists(DATA_DIR):
-        os.makedirs(DATA_DIR)
     config = {
         "strategy": strategy, 
         "period_minutes": period_minutes, 
     }
-    with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-        json.dump(config, f, indent=4, ensure_ascii=False)
+    ai_config.save(config)
 
 def load_settings():
-    """加载配置"""
-    if not os.path.exists(SETTINGS_FILE):
-        return {
-            "tushare_tokens": "", 
-            "selected_provider": "DeepSeek",
-            "api_key": "",
-            "model_name": "deepseek-chat",
-            "base_url": "https://api.deepseek.com",
-            "market_data_source": "sina",
-            "wxpusher_token": "",
-            "wxpusher_uids": "",
-        }
-    with open(SETTINGS_FILE, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    """加载配置（缺省项用默认值补齐）"""
+    return settings_config.get()
 
 def save_settings(settings):
-    with open(SETTINGS_FILE, 'w', encoding='utf-8') as f:
-        json.dump(settings, f, indent=4, ensure_ascii=False)
+    settings_config.save(settings)
 
-def fetch_stock_name_sina(symbol):
+def to_sina_code(symbol):
+    """股票代码转新浪行情代码，如 600000 -> sh600000，已带前缀的原样返回"""
     code = symbol.lower()
     if not (code.startswith('sh') or code.startswith('sz')):
         if code.startswith('6') or code.startswith('9') or code.startswith('5'): code = 'sh' + code
         else: code = 'sz' + code
-    url = f"http://hq.sinajs.cn/list={code}"
+    return code
+
+def _get_sina_session():
+    """新浪行情共用的长连接 Session（keep-alive，避免每次请求重新建连）"""
+    global _sina_session
+    if _sina_session is None:
+        session = requests.Session()
+        session.headers.update({'Referer': 'https://finance.sina.com.cn/'})
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=8)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        _sina_session = session
+    return _sina_session
+
+def fetch_stock_name_sina(symbol):
+    url = SINA_QUOTE_URL + to_sina_code(symbol)
     try:
-        resp = requests.get(url, headers={'Referer': 'https://finance.sina.com.cn'}, timeout=2)
+        resp = _get_sina_session().get(url, timeout=2)
+        resp.encoding = 'gbk'
         if resp.status_code == 200 and len(resp.text) > 20:
             content = resp.text.split('="')[1].split(',')
             return content[0]
@@ -107,58 +214,86 @@ def calculate_indicators(df, params=None):
     df.rename(columns=lambda x: x.lower(), inplace=True)
     if 'close' not in df.columns: return df
     try:
-        # 1. 基础移动平均线 (Trend)
-        df['MA5'] = df['close'].rolling(window=5, min_periods=1).mean()
-        df['MA10'] = df['close'].rolling(window=10, min_periods=1).mean()
-        df['MA20'] = df['close'].rolling(window=20, min_periods=1).mean()
-        df['MA60'] = df['close'].rolling(window=60, min_periods=1).mean()
-        # 2. MACD 计算 (使用标准的 12, 26, 9 参数)
-        exp1 = df['close'].ewm(span=12, adjust=False).mean()
-        exp2 = df['close'].ewm(span=26, adjust=False).mean()
-        df['DIF'] = exp1 - exp2
-        df['DEA'] = df['DIF'].ewm(span=9, adjust=False).mean()
-        df['MACD'] = 2 * (df['DIF'] - df['DEA'])
-        # 3. KDJ 计算 (标准 9, 3, 3)
-        low_list = df['low'].rolling(window=9, min_periods=9).min()
-        high_list = df['high'].rolling(window=9, min_periods=9).max()
-        rsv = (df['close'] - low_list) / (high_list - low_list) * 100
-        rsv = rsv.fillna(50) # 填充空值
-        df['K'] = rsv.ewm(com=2, adjust=False).mean()
-        df['D'] = df['K'].ewm(com=2, adjust=False).mean()
-        df['J'] = 3 * df['K'] - 2 * df['D']
-        # 4. RSI 计算 (14日)
-        delta = df['close'].diff()
-        up = delta.clip(lower=0)
-        down = -1 * delta.clip(upper=0)
-        rs = up.ewm(com=13, adjust=False).mean() / (down.ewm(com=13, adjust=False).mean() + 1e-10)
-        df['RSI'] = 100 - (100 / (1 + rs))
-        # 5. 信号标记：金叉与死叉
-        # MACD 金叉：DIF 上穿 DEA
-        df['MACD_Cross'] = 0
-        df.loc[(df['DIF'] > df['DEA']) & (df['DIF'].shift(1) <= df['DEA'].shift(1)), 'MACD_Cross'] = 1
-        df.loc[(df['DIF'] < df['DEA']) & (df['DIF'].shift(1) >= df['DEA'].shift(1)), 'MACD_Cross'] = -1
+        # MA5/10/20/60、MACD(12,26,9)、KDJ(9,3,3)、RSI(14)、MACD 金叉/死叉，由融合内核一次算出
+        ind = indicator_kernels.compute(df['close'].to_numpy(dtype='float64'), df['high'].to_numpy(dtype='float64'), df['low'].to_numpy(dtype='float64'))
+        for name in indicator_kernels.OUTPUTS:
+            df[name] = ind[name][0]
+        df['MACD_Cross'] = df['MACD_Cross'].astype('int64')
 
         return df
     except Exception as e:
         print(f"指标计算异常: {e}")
         return df
 
+def _parse_sina_quote(fields):
+    """
+    解析新浪行情字段：
+    0名称 1今开 2昨收 3现价 4最高 5最低 6买一价 7卖一价 8成交量(股) 9成交额(元)
+    10-19 买一~买五(量,价) 20-29 卖一~卖五(量,价) 30日期 31时间
+    """
+    if len(fields) <= 30:
+        return None
+    price = float(fields[3])
+    if price < 0.01: price = float(fields[2]) # 未开盘/停牌时用昨收
+    return {
+        'price': price,
+        'name': fields[0],
+        'source': 'sina',
+        'open': float(fields[1]),
+        'pre_close': float(fields[2]),
+        'high': float(fields[4]),
+        'low': float(fields[5]),
+        'bid': float(fields[6]),
+        'ask': float(fields[7]),
+        'vol': float(fields[8]),
+        'amount': float(fields[9]),
+        'bids': [[float(fields[i + 1]), float(fields[i])] for i in range(10, 20, 2)], # [[价格, 数量]] 买一~买五
+        'asks': [[float(fields[i + 1]), float(fields[i])] for i in range(20, 30, 2)], # [[价格, 数量]] 卖一~卖五
+        'date': fields[30],
+        'time': fields[31],
+    }
+
+def _fetch_sina_quotes(codes):
+    """按新浪代码批量请求行情，返回 {新浪代码: 行情dict}，每批最多 SINA_BATCH_SIZE 个代码"""
+    quotes = {}
+    session = _get_sina_session()
+    for i in range(0, len(codes), SINA_BATCH_SIZE):
+        batch = codes[i:i + SINA_BATCH_SIZE]
+        try:
+            metrics.incr("quotes.sina_requests")
+            with metrics.span("quotes.sina"):
+                resp = session.get(SINA_QUOTE_URL + ",".join(batch), timeout=3)
+            resp.encoding = 'gbk'
+            if resp.status_code != 200: continue
+            for code, body in re.findall(r'hq_str_(\w+)="([^"]*)"', resp.text):
+                try:
+                    quote = _parse_sina_quote(body.split(','))
+                    if quote: quotes[code] = quote
+                except ValueError: continue
+        except Exception as e:
+            metrics.incr("quotes.sina_errors")
+            print(f"批量获取行情失败: {e}")
+    return quotes
+
+def get_realtime_quotes(symbols):
+    """
+    批量获取实时行情（新浪），多个代码合并为一次 list= 请求
+    返回 {symbol: 行情dict}，含现价、名称、今开/昨收/最高/最低、成交量额及买卖五档；获取失败的代码返回默认值
+    结果经跨进程共享的 TTL 缓存，有效期由设置项 quote_cache_ttl（秒，0 为关闭）控制
+    """
+    codes = {symbol: to_sina_code(symbol) for symbol in symbols}
+    ttl = float(load_settings().get("quote_cache_ttl", quote_cache.DEFAULT_TTL))
+    with metrics.span("quotes.get"):
+        quotes = _quote_cache.get_many(list(codes.values()), _fetch_sina_quotes, ttl=ttl)
+    return {symbol: quotes.get(code, {'price': 0.0, 'name': '未知', 'source': 'none'}) for symbol, code in codes.items()}
+
+def get_quote_cache_stats():
+    """行情缓存命中统计：hits/misses/coalesced(等待他人抓取)/fetches(实际网络请求次数)"""
+    return _quote_cache.get_stats()
+
 def get_realtime_quote(symbol):
     # 默认使用 Sina，因为最稳定且免费
-    code = symbol.lower()
-    if not (code.startswith('sh') or code.startswith('sz')):
-        code = ('sh' + code) if code.startswith('6') or code.startswith('9') else ('sz' + code)
-    url = f"http://hq.sinajs.cn/list={code}"
-    try:
-        resp = requests.get(url, headers={'Referer': 'https://finance.sina.com.cn/'}, timeout=3)
-        if resp.status_code == 200:
-            content = resp.text.split('="')[1].split(',')
-            if len(content) > 30:
-                price = float(content[3])
-                if price < 0.01: price = float(content[2]) # 昨收
-                return {'price': price, 'name': content[0], 'source': 'sina'}
-    except: pass
-    return {'price': 0.0, 'name': '未知', 'source': 'none'}
+    return get_realtime_quotes([symbol])[symbol]
 
 def get_index_quote(source="sina"):
     """
@@ -168,16 +303,13 @@ def get_index_quote(source="sina"):
     
     if source == "sina":
         data_list = []
+        quotes = get_realtime_quotes(list(index_map.keys()))
         for code, name in index_map.items():
-            url = f"http://hq.sinajs.cn/list={code}"
-            try:
-                r = requests.get(url, headers={'Referer': 'https://finance.sina.com.cn'})
-                parts = r.text.split('="')[1].split(',')
-                price = float(parts[3])
-                pre_close = float(parts[2])
-                chg = (price - pre_close) / pre_close * 100
-                data_list.append({'名称': name, '最新价': price, '涨跌幅': chg, '涨跌额': price-pre_close})
-            except: pass
+            q = quotes[code]
+            if q['source'] == 'none' or q['pre_close'] <= 0: continue
+            price, pre_close = q['price'], q['pre_close']
+            chg = (price - pre_close) / pre_close * 100
+            data_list.append({'名称': name, '最新价': price, '涨跌幅': chg, '涨跌额': price-pre_close})
         return pd.DataFrame(data_list)
         
     elif source == "baostock":
@@ -212,6 +344,128 @@ def get_index_quote(source="sina"):
         
     return pd.DataFrame()
 
+# --- 交易日历：本地缓存沪深交易所日历，按年从 TuShare trade_cal 刷新 ---
+
+class TradeCalendar:
+    """
+    预先为每个自然日计算 (是否交易日, 上一交易日, 下一交易日)，查询均为 O(1) 字典查找
+    超出日历覆盖范围的日期退化为按工作日判断
+    """
+    def __init__(self, cal_dates, is_open):
+        self.info = {}
+        prev_open = None
+        for d, o in zip(cal_dates, is_open):
+            self.info[d] = [bool(o), prev_open, None]
+            if o: prev_open = d
+        next_open = None
+        for d in reversed(cal_dates):
+            self.info[d][2] = next_open
+            if self.info[d][0]: next_open = d
+        self.years = {d[:4] for d in cal_dates}
+
+    def covers(self, year):
+        return str(year) in self.years
+
+    def is_trading_day(self, d):
+        entry = self.info.get(d)
+        if entry is not None:
+            return entry[0]
+        return datetime.strptime(d, "%Y%m%d").weekday() < 5
+
+    def _step(self, d, direction):
+        entry = self.info.get(d)
+        if entry is not None and entry[1 if direction < 0 else 2] is not None:
+            return entry[1 if direction < 0 else 2]
+        day = datetime.strptime(d, "%Y%m%d")
+        while True:
+            day += timedelta(days=direction)
+            s = day.strftime("%Y%m%d")
+            if self.is_trading_day(s): return s
+
+    def previous_trading_day(self, d):
+        return self._step(d, -1)
+
+    def next_trading_day(self, d):
+        return self._step(d, 1)
+
+def _to_date_str(d=None):
+    if d is None: d = datetime.now()
+    if isinstance(d, str): return d.replace("-", "")
+    return d.strftime("%Y%m%d")
+
+def _download_trade_calendar(year):
+    """从 TuShare 下载上一年至下一年的 SSE 交易日历并缓存到本地"""
+    tokens = [t.strip() for t in load_settings().get("tushare_tokens", "").split(',') if t.strip()]
+    if not tokens:
+        return None
+    df = ts.pro_api(tokens[0]).trade_cal(exchange='SSE', start_date=f"{year - 1}0101", end_date=f"{year + 1}1231")
+    if df is None or df.empty:
+        return None
+    df = df[['cal_date', 'is_open']].astype({'cal_date': str, 'is_open': int}).sort_values('cal_date')
+    df.to_csv(TRADE_CAL_FILE, index=False)
+    return df
+
+def get_trade_calendar():
+    """
+    获取交易日历（进程内缓存）。本地文件不含当年时尝试刷新，每天最多尝试一次；
+    无 Token 或网络失败时仍使用已有数据，缺失部分按工作日处理
+    """
+    global _trade_calendar, _trade_calendar_checked
+    today = datetime.now()
+    if _trade_calendar is not None and (_trade_calendar.covers(today.year) or _trade_calendar_checked == today.date()):
+        return _trade_calendar
+
+    df = None
+    if os.path.exists(TRADE_CAL_FILE):
+        try: df = pd.read_csv(TRADE_CAL_FILE, dtype={'cal_date': str})
+        except Exception: df = None
+    if (df is None or not df['cal_date'].str.startswith(str(today.year)).any()) and _trade_calendar_checked != today.date():
+        _trade_calendar_checked = today.date()
+        try:
+            fresh = _download_trade_calendar(today.year)
+            if fresh is not None:
+                df = fresh
+                print(f"交易日历已刷新: {df['cal_date'].iloc[0]} ~ {df['cal_date'].iloc[-1]}")
+        except Exception as e:
+            print(f"交易日历下载失败，按工作日判断: {e}")
+    if df is None or df.empty:
+        df = pd.DataFrame({'cal_date': [], 'is_open': []})
+    _trade_calendar = TradeCalendar(list(df['cal_date']), list(df['is_open']))
+    return _trade_calendar
+
+def is_trading_day(d=None):
+    """d 可为 date/datetime/'YYYYMMDD'/'YYYY-MM-DD'，默认今天"""
+    return get_trade_calendar().is_trading_day(_to_date_str(d))
+
+def previous_trading_day(d=None):
+    """d 之前（不含 d）的最近一个交易日，返回 'YYYYMMDD'"""
+    return get_trade_calendar().previous_trading_day(_to_date_str(d))
+
+def latest_trading_day(d=None):
+    """d 当天若为交易日则返回 d，否则返回之前最近的交易日"""
+    d = _to_date_str(d)
+    return d if is_trading_day(d) else previous_trading_day(d)
+
+def latest_closed_trading_day(now=None):
+    """最近一个已收盘的交易日：交易日收盘前返回前一交易日，即日线数据应已覆盖到的日期"""
+    now = now or datetime.now()
+    d = now.strftime("%Y%m%d")
+    if is_trading_day(d) and now.time() < TRADING_SESSIONS[-1][1]:
+        return previous_trading_day(d)
+    return latest_trading_day(d)
+
+def next_session_open(now=None):
+    """下一个交易时段（上午 09:30 / 下午 13:00）的开盘时间，严格晚于 now"""
+    now = now or datetime.now()
+    cal = get_trade_calendar()
+    d = now.strftime("%Y%m%d")
+    if cal.is_trading_day(d):
+        for open_time, _ in TRADING_SESSIONS:
+            session_open = datetime.combine(now.date(), open_time)
+            if session_open > now: return session_open
+    next_day = datetime.strptime(cal.next_trading_day(d), "%Y%m%d")
+    return datetime.combine(next_day.date(), TRADING_SESSIONS[0][0])
+
 class TushareScheduler:
     def __init__(self, tokens):
         self.tokens = tokens
@@ -224,6 +478,7 @@ class TushareScheduler:
             self.index = (self.index + 1) % len(self.tokens)
             ts.set_token(self.tokens[self.index])
             self.pro = ts.pro_api()
+            metrics.incr("tushare.token_switches")
             print(f"切换至 Token 索引: {self.index}")
             return True
         return False
@@ -231,9 +486,141 @@ class TushareScheduler:
     def get_pro(self):
         return self.pro
 
+class TokenBucket:
+    """
+    令牌桶限流器：平均每分钟 rate_per_min 次，允许少量突发
+    触发接口限频后按错误信息学习真实额度，并暂停到下一个分钟窗口
+    """
+    def __init__(self, rate_per_min, burst=5):
+        self.lock = threading.Lock()
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.set_rate(rate_per_min)
+
+    def set_rate(self, rate_per_min):
+        self.rate_per_min = max(1.0, float(rate_per_min))
+        self.rate = self.rate_per_min / 60.0
+
+    def acquire(self, give_up=None):
+        """阻塞直到获得一个调用额度；等待期间 give_up() 为真时放弃并返回 False"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now >= self.paused_until:
+                    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return True
+                    wait = (1 - self.tokens) / self.rate
+                else:
+                    wait = self.paused_until - now
+            if give_up is not None and give_up():
+                return False
+            time.sleep(min(wait, 0.5))
+
+    def on_rate_limited(self, err_msg):
+        """根据 “每分钟最多访问该接口N次” 调整速率（留 10% 余量），并暂停一分钟"""
+        with self.lock:
+            match = re.search(r"最多访问[^\d]*(\d+)\s*次", err_msg)
+            if match:
+                self.set_rate(int(match.group(1)) * 0.9)
+            else:
+                self.set_rate(self.rate_per_min * 0.7)
+            self.tokens = 0.0
+            self.updated = self.paused_until = time.monotonic() + 60
+        return self.rate_per_min
+
+def is_rate_limit_error(err_msg):
+    return "抱歉，您每分钟最多访问" in err_msg or "接口请求频率超限" in err_msg
+
+class TushareDownloader:
+    """
+    多 Token 并发下载器：每个 Token 一条工作通道（线程 + 独立令牌桶），
+    所有通道共享同一个任务队列，总吞吐随 Token 数线性增长
+    """
+    def __init__(self, tokens, rate_per_min=TUSHARE_RATE_PER_MIN, max_retries=3):
+        self.tokens = tokens
+        self.rate_per_min = rate_per_min
+        self.max_retries = max_retries
+
+    def run(self, tasks, fetch, on_result):
+        """
+        tasks: 任务列表；fetch(pro, task) 在通道线程中执行接口调用
+        on_result(task, result): 成功后在通道线程中回调，需自行保证线程安全
+        返回重试耗尽仍失败的任务列表
+        """
+        work = queue.Queue()
+        for task in tasks:
+            work.put((task, 0))
+        failed = []
+        failed_lock = threading.Lock()
+
+        def lane(index, token):
+            pro = ts.pro_api(token)
+            bucket = TokenBucket(self.rate_per_min)
+            while True:
+                # 先取得额度再领取任务，避免暂停中的通道占住任务；队列空了就直接退出
+                if not bucket.acquire(give_up=work.empty):
+                    return
+                try:
+                    task, retry = work.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    metrics.incr("tushare.calls")
+                    with metrics.span("tushare.fetch"):
+                        result = fetch(pro, task)
+                except Exception as e:
+                    err_msg = str(e)
+                    if is_rate_limit_error(err_msg):
+                        metrics.incr("tushare.rate_limited")
+                        # 限频不计入重试次数，任务放回队列由其他通道继续处理
+                        rate = bucket.on_rate_limited(err_msg)
+                        print(f"Token {index} 触发限频，暂停60秒，速率调整为 {rate:.0f} 次/分钟")
+                        work.put((task, retry))
+                    elif retry + 1 < self.max_retries:
+                        metrics.incr("tushare.retries")
+                        print(f"下载 {task} 出错 (重试 {retry}): {e}")
+                        time.sleep(2 ** retry) # 指数退避
+                        work.put((task, retry + 1))
+                    else:
+                        metrics.incr("tushare.failures")
+                        with failed_lock:
+                            failed.append(task)
+                    continue
+                try:
+                    on_result(task, result)
+                except Exception as e:
+                    print(f"处理 {task} 结果出错: {e}")
+
+        threads = [threading.Thread(target=lane, args=(i, token), name=f"TushareLane-{i}") for i, token in enumerate(self.tokens)]
+        for t in threads: t.start()
+        for t in threads: t.join()
+        return failed
+
+def load_history_manifest():
+    """读取全量初始化的断点清单，不存在或损坏时返回 None"""
+    if not os.path.exists(MANIFEST_FILE):
+        return None
+    try:
+        with open(MANIFEST_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"断点清单损坏，将重新开始全量初始化: {e}")
+        return None
+
+def save_history_manifest(manifest):
+    with open(MANIFEST_FILE + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(MANIFEST_FILE + ".tmp", MANIFEST_FILE)
+
 def init_history_data_tushare():
     """
     【修正版】全量初始化：具备多Token轮换、指数重试、断点续传能力的工业级下载函数
+    下载进度记录在 data/history_manifest.json，中断后再次执行会跳过已完成的股票
     """
     settings = load_settings()
     tokens = [t.strip() for t in settings.get("tushare_tokens", "").split(',') if t.strip()]
@@ -241,18 +628,30 @@ def init_history_data_tushare():
         return False, "错误：未配置 TuShare Token"
     
     scheduler = TushareScheduler(tokens)
+    # 按最近已收盘的交易日判断完整性，而非运行当天的日历日期：跨日续传（如凌晨崩溃后重跑）不会重新下载全市场
+    target_date = latest_closed_trading_day()
 
-    # 1. 备份与目录准备 (保留)
-    if os.path.exists(HISTORY_DIR) and os.listdir(HISTORY_DIR):
-        backup_name = f"history_bak_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-        backup_dirname = os.path.join(DATA_DIR, backup_name)
-        if os.path.exists(backup_dirname):
-            print('备份失败: 目标目录已存在')
-            return False, f"备份失败: 目标目录`{backup_name}`已存在, 请检查是否有同名目录"
-        shutil.move(HISTORY_DIR, backup_dirname)
+    # 1. 断点续传：存在未完成的清单时直接续传，不再备份历史目录
+    manifest = load_history_manifest()
+    resuming = manifest is not None and not manifest.get('completed', False)
+    if resuming:
+        print(f"检测到未完成的全量初始化 ({manifest.get('started_at')})，已完成 {len(manifest['symbols'])} 只，继续下载...")
+    else:
+        # 备份与目录准备 (保留)
+        if os.path.exists(HISTORY_DIR) and os.listdir(HISTORY_DIR):
+            backup_name = f"history_bak_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+            backup_dirname = os.path.join(DATA_DIR, backup_name)
+            if os.path.exists(backup_dirname):
+                print('备份失败: 目标目录已存在')
+                return False, f"备份失败: 目标目录`{backup_name}`已存在, 请检查是否有同名目录"
+            shutil.move(HISTORY_DIR, backup_dirname)
+        indicator_engine.reset_states() # 历史重新下载后，旧的增量指标状态失效
+        manifest = {"started_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "completed": False, "symbols": {}}
     
     if not os.path.exists(HISTORY_DIR):
         os.makedirs(HISTORY_DIR)
+    manifest['target_date'] = target_date
+    save_history_manifest(manifest)
 
     # 2. 获取股票列表
     try:
@@ -264,50 +663,129 @@ def init_history_data_tushare():
 
     total = len(stock_list)
     success_count = 0
-    
-    # 3. 循环下载（带多级重试逻辑）
-    for i, row in stock_list.iterrows():
-        ts_code = row['ts_code']
-        symbol = row['symbol']
-        
-        # 指数退避重试逻辑
-        max_retries = 3
-        for retry in range(max_retries):
-            try:
-                # 随机延迟防止过于规律的请求
-                df = scheduler.get_pro().daily(ts_code=ts_code, start_date='20200101', adj='qfq')
-                if not df.empty:
-                    df = df.iloc[::-1] # 升序
-                    df.to_csv(os.path.join(HISTORY_DIR, f"{symbol}.csv"), index=False)
-                    success_count += 1
-                
+    manifest_lock = threading.Lock()
+
+    # 已下载到目标交易日的股票直接跳过；停牌/无数据的股票若下载时目标交易日已收盘，同样视为完成
+    def is_complete(symbol):
+        entry = manifest['symbols'].get(symbol)
+        if entry is None: return False
+        covered = str(entry.get('end') or '') >= target_date or str(entry.get('target', '')) >= target_date
+        return covered and (entry['rows'] == 0 or read_history_raw(symbol, columns=['trade_date']) is not None)
+
+    tasks = [(ts_code, symbol) for ts_code, symbol in zip(stock_list['ts_code'], stock_list['symbol']) if not is_complete(symbol)]
+    skipped = total - len(tasks)
+    if skipped:
+        print(f"跳过已完成的 {skipped} 只股票，剩余 {len(tasks)} 只")
+
+    # 3. 多 Token 并发下载：每个 Token 一条通道，各自限频，共享任务队列
+    def fetch(pro, task):
+        ts_code, symbol = task
+        return pro.daily(ts_code=ts_code, start_date='20200101', adj='qfq')
+
+    def on_result(task, df):
+        nonlocal success_count
+        ts_code, symbol = task
+        entry = {"rows": 0, "start": None, "end": None, "target": target_date}
+        if df is not None and not df.empty:
+            df = write_history(symbol, df)
+            entry.update(rows=len(df), start=int(df['trade_date'].iloc[0]), end=int(df['trade_date'].iloc[-1]))
+        with manifest_lock:
+            manifest['symbols'][symbol] = entry
+            if entry['rows'] > 0:
+                success_count += 1
                 # 打印进度
                 if success_count % 50 == 0:
-                    print(f"进度: {success_count}/{total}")
-                
-                # 基础限频：每秒最多请求数取决于积分，这里给个保守值
-                time.sleep(0.2) 
-                break # 成功则跳出重试循环
+                    print(f"进度: {success_count + skipped}/{total}")
+            # 定期落盘断点，崩溃时最多重下 MANIFEST_FLUSH_EVERY 只
+            if len(manifest['symbols']) % MANIFEST_FLUSH_EVERY == 0:
+                save_history_manifest(manifest)
 
-            except Exception as e:
-                err_msg = str(e)
-                if "抱歉，您每分钟最多访问" in err_msg or "接口请求频率超限" in err_msg:
-                    print(f"检测到限频，尝试切换 Token...")
-                    if not scheduler.next_token():
-                        # 如果没有更多Token，强制休眠一分钟
-                        print("无更多Token可用，强制等待60秒...")
-                        time.sleep(60)
-                else:
-                    print(f"下载 {symbol} 出错 (重试 {retry}): {e}")
-                    time.sleep(2 ** retry) # 指数退避
-        
-        # 实时反馈给 UI 的状态更新（通过打印或文件，UI层会捕获）
+    downloader = TushareDownloader(tokens, rate_per_min=settings.get("tushare_rate_per_min", TUSHARE_RATE_PER_MIN))
+    failed = downloader.run(tasks, fetch, on_result)
+    if failed:
+        print(f"以下股票多次重试仍失败，下次执行将续传: {[symbol for _, symbol in failed]}")
+    manifest['completed'] = not failed
+    save_history_manifest(manifest)
     
-    return True, f"初始化完成！成功下载 {success_count}/{total} 只股票。备份已存至 data 目录。"
+    msg = f"初始化完成！成功下载 {success_count}/{len(tasks)} 只股票"
+    if skipped:
+        msg += f"，{skipped} 只已在上次完成并跳过"
+    if failed:
+        msg += f"，{len(failed)} 只失败（再次执行可续传）"
+    return True, msg + ("。" if resuming else "。备份已存至 data 目录。")
+
+def _fetch_daily_by_date(scheduler, trade_date, retries):
+    """按交易日拉取全市场日线，失败时轮换 Token 重试"""
+    for attempt in range(retries):
+        try:
+            metrics.incr("tushare.calls")
+            if attempt: metrics.incr("tushare.retries")
+            with metrics.span("tushare.daily"):
+                return scheduler.get_pro().daily(trade_date=trade_date)
+        except:
+            if not scheduler.next_token(): break
+    return None
+
+def _history_last_date(symbol):
+    """
+    单只股票本地最新交易日，无数据时返回 None
+    Parquet 优先读文件尾部的列统计（不解析数据页），缺少统计时再读取 trade_date 列
+    """
+    path = _history_path(symbol, 'parquet')
+    if os.path.exists(path):
+        meta = pq.read_metadata(path)
+        names = [meta.schema.column(i).name for i in range(meta.num_columns)]
+        if 'trade_date' in names and meta.num_row_groups:
+            col = names.index('trade_date')
+            stats = [meta.row_group(i).column(col).statistics for i in range(meta.num_row_groups)]
+            if all(st is not None and st.has_min_max for st in stats):
+                return int(max(st.max for st in stats))
+    df = read_history_raw(symbol, columns=['trade_date'])
+    if df is None or df.empty:
+        return None
+    return int(df['trade_date'].max())
+
+def get_store_last_dates(symbols=None):
+    """本地仓库各股的最新交易日 {symbol: int}"""
+    if symbols is None:
+        symbols = list_local_symbols()
+    last_dates = {}
+    for symbol in symbols:
+        try:
+            last_date = _history_last_date(symbol)
+        except Exception:
+            continue
+        if last_date is not None:
+            last_dates[symbol] = last_date
+    return last_dates
+
+def get_store_sync_date(symbols=None, last_dates=None):
+    """
+    本地仓库的同步日期：各股最新交易日中出现次数最多的那一天
+    长期停牌/退市股的最新日期偏早，不应拖慢整体的回补起点
+    last_dates: 已读取的 get_store_last_dates 结果，传入时不再重读文件
+    """
+    if last_dates is None:
+        last_dates = get_store_last_dates(symbols)
+    if not last_dates:
+        return None
+    return int(pd.Series(list(last_dates.values())).mode().max())
+
+def _missing_trade_dates(since, today):
+    """since(不含) 到 today(含) 之间需要回补的交易日（按交易日历），最多回溯 UPDATE_CATCHUP_DAYS 天"""
+    today_dt = datetime.strptime(today, "%Y%m%d")
+    start = today_dt - timedelta(days=UPDATE_CATCHUP_DAYS)
+    if since is not None:
+        start = max(start, datetime.strptime(str(since), "%Y%m%d") + timedelta(days=1))
+    cal = get_trade_calendar()
+    days = (d.strftime("%Y%m%d") for d in pd.date_range(start, today_dt))
+    return [d for d in days if cal.is_trading_day(d)]
 
 def update_today_data_tushare():
     """
     【修正版】每日增量更新：同样应用 Token 轮换逻辑，防止更新到一半卡死
+    自动回补仓库同步日之后缺失的交易日（每个交易日一次全市场请求），
+    只追加晚于本地最新交易日的K线，每只股票每次运行只写一次，重复执行不会产生重复K线
     """
     settings = load_settings()
     tokens = [t.strip() for t in settings.get("tushare_tokens", "").split(',') if t.strip()]
@@ -317,127 +795,390 @@ def update_today_data_tushare():
     today_str = datetime.now().strftime("%Y%m%d")
     
     try:
-        # 获取当天所有股票日线数据
-        df_today = None
-        for _ in range(len(tokens) + 1):
-            try:
-                df_today = scheduler.get_pro().daily(trade_date=today_str)
-                break
-            except:
-                if not scheduler.next_token(): break
+        # 1. 计算需要回补的交易日
+        last_dates = get_store_last_dates()
+        missing_dates = _missing_trade_dates(get_store_sync_date(last_dates=last_dates), today_str)
+        if not missing_dates:
+            return "增量更新完成，数据已是最新"
+
+        # 2. 逐日拉取全市场日线
+        frames = []
+        with metrics.span("history.update.fetch"):
+            for trade_date in missing_dates:
+                df_day = _fetch_daily_by_date(scheduler, trade_date, len(tokens) + 1)
+                if df_day is not None and not df_day.empty:
+                    frames.append(df_day)
+        # 最近一个应有数据的交易日（通常为今天）是否已出数据
+        has_today = any(str(df_day['trade_date'].iloc[0]) == missing_dates[-1] for df_day in frames)
         
-        if df_today is None or df_today.empty:
+        if not frames:
             return "TuShare 今日无数据 (非交易日或未收盘)"
 
+        # 3. 按股票批量追加：只有新增K线需要类型归一，每只股票只写一次
+        df_new = _normalize_history_types(pd.concat(frames, ignore_index=True))
+        df_new['symbol'] = df_new['ts_code'].str.split('.').str[0]
+        df_new = df_new.sort_values('trade_date', kind='stable').drop_duplicates(subset=['symbol', 'trade_date'], keep='last')
         update_count = 0
-        for _, row in df_today.iterrows():
-            symbol = row['ts_code'].split('.')[0]
-            csv_path = os.path.join(HISTORY_DIR, f"{symbol}.csv")
-            
-            if os.path.exists(csv_path):
-                # 将 row 转换为 CSV 格式并追加
-                # 注意：这里需要确保 CSV 列顺序一致
-                try:
-                    # 读取表头确定顺序
-                    df_old = pd.read_csv(csv_path, nrows=0)
-                    row_df = pd.DataFrame([row])
-                    row_df = row_df[df_old.columns] # 强制列对齐
-                    row_df.to_csv(csv_path, mode='a', header=False, index=False)
-                    update_count += 1
-                except: continue
-
-        return f"增量更新完成，共更新 {update_count} 只股票"
+        for symbol, rows in df_new.groupby('symbol', sort=False):
+            if symbol not in last_dates: continue
+            rows = rows[rows['trade_date'] > last_dates[symbol]]
+            if rows.empty: continue # 已是最新，跳过读写
+            try:
+                df_old = read_history_raw(symbol)
+                if df_old is None: continue
+                rows = rows.reindex(columns=df_old.columns) # 强制列对齐
+                merged = pd.concat([df_old, rows], ignore_index=True)
+                with metrics.span("history.write"):
+                    merged = write_history(symbol, merged)
+                update_count += 1
+                # 同步已有的增量指标状态（只递推新增K线）；没有状态的股票在首次读取指标时再建立
+                with metrics.span("indicators.append"):
+                    indicator_engine.append_bars(symbol, merged)
+            except Exception as e:
+                print(f"合并 {symbol} 失败: {e}")
+                continue
+
+        if not has_today:
+            return f"TuShare 今日无数据 (非交易日或未收盘)，已回补 {len(frames)} 个交易日，更新 {update_count} 只股票"
+        return f"增量更新完成，共更新 {update_count} 只股票（回补 {len(frames)} 个交易日）"
     except Exception as e:
         return f"更新过程中发生异常: {e}"
     
+# --- 历史数据存储层 (Parquet 列式存储，兼容旧 CSV) ---
+
+def _history_path(symbol, fmt=None):
+    return os.path.join(HISTORY_DIR, f"{symbol}.{fmt or HISTORY_FORMAT}")
+
+def _has_history_types(df):
+    """是否已是存储类型（trade_date 为升序 int64，价格为 float32），是则写入时可跳过归一"""
+    dtypes = df.dtypes
+    if dtypes.get('trade_date') != 'int64' or not df['trade_date'].is_monotonic_increasing:
+        return False
+    if 'ts_code' in dtypes and not pd.api.types.is_string_dtype(dtypes['ts_code']):
+        return False
+    return (all(dtypes[col] == 'float32' for col in PRICE_COLUMNS if col in dtypes)
+            and all(dtypes[col] == 'float64' for col in VOLUME_COLUMNS if col in dtypes))
+
+def _normalize_history_types(df):
+    """统一历史数据列类型：trade_date 为 int64，价格为 float32"""
+    df = df.copy()
+    if 'trade_date' in df.columns:
+        df['trade_date'] = pd.to_numeric(df['trade_date'], errors='coerce')
+        df = df.dropna(subset=['trade_date'])
+        df['trade_date'] = df['trade_date'].astype('int64')
+    if 'ts_code' in df.columns:
+        df['ts_code'] = df['ts_code'].astype(str)
+    for col in PRICE_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype('float32')
+    for col in VOLUME_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype('float64')
+    return df
+
+def list_local_symbols():
+    """列出本地仓库中所有股票代码（Parquet 与未迁移的 CSV）"""
+    if not os.path.exists(HISTORY_DIR):
+        return []
+    symbols = set()
+    for f in os.listdir(HISTORY_DIR):
+        name, ext = os.path.splitext(f)
+        if ext in ('.parquet', '.csv'):
+            symbols.add(name)
+    return sorted(symbols)
+
+def read_history_raw(symbol, columns=None):
+    """
+    读取单只股票的原始日线（升序，RangeIndex），不存在时返回 None
+    columns: 只读取指定列，Parquet 下可跳过无关列的解析
+    """
+    path = _history_path(symbol, 'parquet')
+    if os.path.exists(path):
+        return pd.read_parquet(path, columns=columns)
+    path = _history_path(symbol, 'csv')
+    if os.path.exists(path):
+        usecols = (lambda c: c in columns) if columns else None
+        return _normalize_history_types(pd.read_csv(path, usecols=usecols))
+    return None
+
+def write_history(symbol, df):
+    """
+    按 HISTORY_FORMAT 写入单只股票日线（先写临时文件再替换，避免写到一半损坏）
+    返回类型归一、按日期升序后的实际写入数据
+    """
+    if _has_history_types(df):
+        df = df.reset_index(drop=True)
+    else:
+        df = _normalize_history_types(df)
+        if 'trade_date' in df.columns:
+            df = df.sort_values('trade_date').reset_index(drop=True)
+    path = _history_path(symbol)
+    tmp_path = path + ".tmp"
+    if HISTORY_FORMAT == "parquet":
+        df.to_parquet(tmp_path, index=False)
+    else:
+        df.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+    # 写入 Parquet 后清理同名旧 CSV，避免两份数据不一致
+    legacy_path = _history_path(symbol, 'csv')
+    if HISTORY_FORMAT == "parquet" and os.path.exists(legacy_path):
+        os.remove(legacy_path)
+    return df
+
+def migrate_history_to_parquet():
+    """一次性迁移：将 HISTORY_DIR 下的 CSV 全部转换为 Parquet"""
+    if HISTORY_FORMAT != "parquet":
+        return False, "未安装 pyarrow，无法迁移到 Parquet"
+    files = [f for f in os.listdir(HISTORY_DIR) if f.endswith('.csv')]
+    success_count = 0
+    for f in files:
+        symbol = f.replace('.csv', '')
+        try:
+            write_history(symbol, pd.read_csv(os.path.join(HISTORY_DIR, f)))
+            success_count += 1
+        except Exception as e:
+            print(f"迁移 {symbol} 失败: {e}")
+    return True, f"迁移完成，共转换 {success_count}/{len(files)} 个文件"
+
+def get_latest_indicators(symbol):
+    """
+    单只股票最新一根K线的指标（增量引擎，免去每次全量重算）
+    状态缺失时用本地历史重建；数据不足30根时只返回 close
+    """
+    with metrics.span("indicators.latest"):
+        return indicator_engine.get_latest(symbol, read_history_raw)
+
+def _int_dates_to_datetime(dates):
+    """
+    int64 的 YYYYMMDD 日期数组按位拆出年月日，用 datetime64 运算直接转换，免去逐行转字符串再解析
+    非法日期（如 20230231）置为 NaT
+    """
+    month = dates // 100 % 100
+    day = dates % 100
+    first = ((dates // 10000 - 1970) * 12 + month - 1).astype('datetime64[M]')
+    result = first.astype('datetime64[D]') + (day - 1)
+    valid = (month >= 1) & (month <= 12) & (day >= 1) & (result.astype('datetime64[M]') == first)
+    return pd.to_datetime(np.where(valid, result, np.datetime64('NaT')).astype('datetime64[ns]'))
+
 def load_local_history(symbol):
-    path = os.path.join(HISTORY_DIR, f"{symbol}.csv")
-    if not os.path.exists(path):
+    df = read_history_raw(symbol)
+    if df is None:
         return pd.DataFrame(columns=['trade_date', 'close', 'open', 'high', 'low', 'vol'])
     try:
-        df = pd.read_csv(path)
-        df['trade_date'] = pd.to_datetime(df['trade_date'].astype(str), format='%Y%m%d', errors='coerce')
+        df['trade_date'] = _int_dates_to_datetime(df['trade_date'].to_numpy('int64'))
         df.set_index('trade_date', inplace=True)
         df.sort_index(inplace=True)
         return df
     except:
         return pd.DataFrame()
 
-def screen_stocks_local(strategy_name):
+def load_stock_basic_names():
+    """读取 data/stock_basic.csv 中 symbol -> name 的映射，不存在时返回空字典"""
+    basic_path = os.path.join(DATA_DIR, "stock_basic.csv")
+    if os.path.exists(basic_path):
+        try:
+            df_basic = pd.read_csv(basic_path, dtype={'symbol': str})
+            return dict(zip(df_basic['symbol'], df_basic['name']))
+        except: pass
+    return {}
+
+# --- 全市场 Map-Reduce：按分块将逐股函数分发到进程池 ---
+
+def _map_symbols_chunk(func, symbols, columns, history_dir):
+    """进程池工作函数：在子进程中逐只读取历史数据并执行 func，单只出错不影响整块"""
+    global HISTORY_DIR
+    HISTORY_DIR = history_dir # Windows 下子进程为 spawn 启动，需显式同步仓库路径
+    out = []
+    for symbol in symbols:
+        try:
+            df = read_history_raw(symbol, columns=columns)
+            out.append((symbol, func(symbol, df) if df is not None else None))
+        except Exception:
+            out.append((symbol, None))
+    return out
+
+def map_universe(func, symbols=None, columns=None, chunk_size=MAP_CHUNK_SIZE, max_workers=None,
+                 progress_callback=None, cancel_event=None):
+    """
+    对每只股票的历史数据执行 func(symbol, df)，以生成器形式流式返回 (symbol, result)
+    - func: 必须可 pickle（模块级函数或其 functools.partial），在子进程中执行；出错时 result 为 None
+    - columns: 只读取指定列，减少 IO
+    - progress_callback(done, total): 每完成一个分块回调一次
+    - cancel_event: threading.Event，置位后取消尚未开始的分块并停止产出
+    返回顺序按分块完成先后，不保证与 symbols 一致
+    """
+    if symbols is None:
+        symbols = list_local_symbols()
+    total = len(symbols)
+    if total == 0:
+        return
+    chunks = [symbols[i:i + chunk_size] for i in range(0, total, chunk_size)]
+
+    executor = ProcessPoolExecutor(max_workers=max_workers or os.cpu_count())
+    futures = []
+    try:
+        futures = [executor.submit(_map_symbols_chunk, func, chunk, columns, HISTORY_DIR) for chunk in chunks]
+        done = 0
+        for future in as_completed(futures):
+            if cancel_event is not None and cancel_event.is_set():
+                break
+            chunk_result = future.result()
+            done += len(chunk_result)
+            for item in chunk_result:
+                yield item
+            if progress_callback:
+                progress_callback(done, total)
+    finally:
+        # 提前结束（取消或调用方中断迭代）时丢弃排队中的分块（shutdown 的 cancel_futures 参数需 Python 3.9+）
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+def _screen_symbol(symbol, df, strategy_name):
+    """单只股票的选股判断（供 map_universe 在子进程中调用），未命中返回 None"""
+    if len(df) < 60: return None # 过滤2：上市不满60天的次新股
+    
+    # 计算指标用于选股
+    df = calculate_indicators(df)
+    curr = df.iloc[-1]
+    
+    # 过滤3：停牌过滤
+    if curr['vol'] <= 0: return None
+
+    # 最新一根K线组成长度为1的列，与面板模式共用策略表达式
+    cols = {k: np.array([curr[k]], dtype='float64') for k in df.columns if k in curr and np.isscalar(curr[k]) and k != 'ts_code'}
+    cols['vol_ratio'] = indicator_kernels.volume_ratio(df['vol'].to_numpy(dtype='float64'))[0, -1:] # 对比5日均量
+    mask, score, reason = strategies.get_strategy(strategy_name).evaluate(cols, [symbol])
+    if not mask[0]:
+        return None
+    return {
+        'symbol': symbol, # 股票代码
+        'name': "", # 股票名称，由主进程填充
+        'score': round(float(score[0]), 1),
+        'reason': reason[0],
+        'close': curr['close'], # 最新收盘价
+        'pct_chg': curr['pct_chg'] # 涨跌幅
+    }
+
+def screen_stocks_local(strategy_name, progress_callback=None, cancel_event=None):
     """
     【修正版】严谨选股逻辑：剔除垃圾股，增加停牌和量比校验
+    逐股判断通过 map_universe 分发到多进程并行执行
     """
     results = []
     if not os.path.exists(HISTORY_DIR):
         return []
 
     # 获取所有股票的基本信息（用于过滤ST和名称）
-    # 假设你在初始化时保存了 stock_basic.csv，如果没有，我们从历史文件名中提取
-    files = [f for f in os.listdir(HISTORY_DIR) if f.endswith('.csv')]
-    
     # 临时获取 stock_basic 用于过滤 ST (建议在初始化时保存一份到 data/stock_basic.csv)
-    basic_info = {}
-    basic_path = os.path.join(DATA_DIR, "stock_basic.csv")
-    if os.path.exists(basic_path):
-        try:
-            df_basic = pd.read_csv(basic_path)
-            # symbol -> name 的映射
-            basic_info = dict(zip(df_basic['symbol'].astype(str), df_basic['name']))
-        except: pass
+    basic_info = load_stock_basic_names()
 
-    for f in files:
-        symbol = f.replace('.csv', '')
-        try:
-            # 过滤1：名称过滤（剔除ST、退市、*ST）
-            name = basic_info.get(symbol, "")
-            if any(x in name for x in ["ST", "退市", "B股", "北证"]): 
-                continue
+    # 过滤1：名称过滤（剔除ST、退市、*ST），在主进程中完成，不再派发
+    symbols = [s for s in list_local_symbols()
+               if not any(x in basic_info.get(s, "") for x in EXCLUDED_NAME_KEYWORDS)]
 
-            df = pd.read_csv(os.path.join(HISTORY_DIR, f))
-            if len(df) < 60: continue # 过滤2：上市不满60天的次新股
-            
-            # 计算指标用于选股
-            df = calculate_indicators(df)
-            curr = df.iloc[-1]
-            
-            # 过滤3：停牌过滤
-            if curr['vol'] <= 0: continue 
-
-            score = 0
-            reason = ""
-            
-            # --- 策略：一夜持股 (修正后的量价共振逻辑) ---
-            if strategy_name == "overnight":
-                vol_ratio = curr['vol'] / (df['vol'].rolling(5).mean().iloc[-2] + 1) # 对比5日均量
-                
-                # 逻辑：涨幅在3%-8%之间，放量1.5倍以上，收盘价站上MA5且处于上升趋势
-                if 3 < curr['pct_chg'] < 8 and vol_ratio > 1.8:
-                    if curr['close'] > curr['MA5'] and curr['DIF'] > 0:
-                        score = 80 + min(vol_ratio * 2, 15) # 量比越大权重越高，最高加15分
-                        reason = f"量比{vol_ratio:.1f} 趋势向上"
-            
-            # --- 策略：打板策略 (修正后的强势股逻辑) ---
-            elif strategy_name == "limit_up":
-                # A股主板涨停一般 > 9.9%，创业板 > 19.9%
-                if (symbol.startswith('60') or symbol.startswith('00')) and curr['pct_chg'] > 9.8:
-                    score = 95
-                    reason = "主板涨停"
-                elif (symbol.startswith('30') or symbol.startswith('68')) and curr['pct_chg'] > 19.8:
-                    score = 98
-                    reason = "双创涨停"
-
-            if score > 0:
-                results.append({
-                    'symbol': symbol, # 股票代码
-                    'name': name, # 股票名称
-                    'score': round(score, 1),
-                    'reason': reason,
-                    'close': curr['close'], # 最新收盘价
-                    'pct_chg': curr['pct_chg'] # 涨跌幅
-                })
-        except Exception as e:
-            # print(f"解析 {symbol} 失败: {e}")
-            continue
+    func = functools.partial(_screen_symbol, strategy_name=strategy_name)
+    for symbol, res in map_universe(func, symbols, progress_callback=progress_callback, cancel_event=cancel_event):
+        if res:
+            res['name'] = basic_info.get(symbol, "")
+            results.append(res)
 
     # 按分数降序排列
-    return sorted(results, key=lambda x: x['score'], reverse=True)[:50]
\ No newline at end of file
+    return sorted(results, key=lambda x: x['score'], reverse=True)[:50]
+
+# --- 面板模式选股：一次载入全市场，向量化计算指标与策略掩码 ---
+
+def load_history_panel(symbols=None, bars=PANEL_BARS, fields=PANEL_FIELDS):
+    """
+    载入全市场最近 bars 根日线，组成 (symbols × dates) 的二维数组面板
+    每只股票右对齐：最后一列为各自最新一根K线，历史不足部分以 NaN 填充
+    返回 dict: symbols, trade_date(int64, 缺失为0), rows(各股完整历史条数), 以及 fields 中的各字段(float64)
+    """
+    if symbols is None:
+        symbols = list_local_symbols()
+    n = len(symbols)
+    panel = {f: np.full((n, bars), np.nan) for f in fields}
+    panel['trade_date'] = np.zeros((n, bars), dtype='int64')
+    panel['rows'] = np.zeros(n, dtype='int64')
+    panel['symbols'] = list(symbols)
+
+    columns = ['trade_date'] + list(fields)
+    for i, symbol in enumerate(symbols):
+        try:
+            df = read_history_raw(symbol, columns=columns)
+        except Exception:
+            continue
+        if df is None or df.empty: continue
+        tail = df.iloc[-bars:]
+        k = len(tail)
+        panel['rows'][i] = len(df)
+        panel['trade_date'][i, bars - k:] = tail['trade_date'].to_numpy()
+        for f in fields:
+            if f in tail.columns:
+                panel[f][i, bars - k:] = tail[f].to_numpy(dtype='float64')
+    return panel
+
+def calculate_panel_indicators(panel):
+    """
+    在面板上整体计算全部指标（与 calculate_indicators 口径一致），全市场一次调用融合内核
+    每只股票从其首个有效K线起算，右对齐面板左侧的空位输出 NaN
+    """
+    ind = indicator_kernels.compute(panel['close'], panel['high'], panel['low'])
+    # 量比：当日成交量 / 前5日均量
+    ind['vol_ratio'] = indicator_kernels.volume_ratio(panel['vol'])
+    return ind
+
+def _panel_strategy_hits(strategy_name, cols, symbols, with_reason=True):
+    """
+    计算单个策略的命中掩码与得分，cols 中各数组形状一致（可为一维或二维）
+    策略定义见 strategies.py（声明式规则，编译为向量化表达式）
+    返回 (mask, score, reason)，reason 为与 mask 同形状的字符串数组
+    """
+    return strategies.get_strategy(strategy_name).evaluate(cols, symbols, with_reason=with_reason)
+
+def screen_stocks_panel(strategy_names=None, bars=PANEL_BARS):
+    """
+    面板模式选股：单次载入 + 向量化计算，一次返回多个策略的结果
+    strategy_names 默认为注册表中的全部策略
+    返回 dict: {strategy_name: [结果列表，格式同 screen_stocks_local]}
+    """
+    if strategy_names is None:
+        strategy_names = [name for name, _ in strategies.list_strategies()]
+    symbols = list_local_symbols()
+    if not symbols:
+        return {name: [] for name in strategy_names}
+
+    panel = load_history_panel(symbols, bars=bars)
+    ind = calculate_panel_indicators(panel)
+
+    # 预计算名称过滤掩码（剔除ST、退市、B股、北证）
+    basic_info = load_stock_basic_names()
+    names = pd.Series([basic_info.get(s, "") for s in symbols], dtype=object)
+    name_ok = ~names.str.contains("|".join(EXCLUDED_NAME_KEYWORDS), regex=True).to_numpy(dtype=bool)
+
+    # 只取每只股票最新一根K线参与选股
+    cols = {k: v[:, -1] for k, v in panel.items() if isinstance(v, np.ndarray) and v.ndim == 2}
+    cols.update({k: v[:, -1] for k, v in ind.items()})
+    with np.errstate(invalid='ignore'):
+        base_ok = name_ok & (panel['rows'] >= 60) & (cols['vol'] > 0)
+
+    results = {}
+    for strategy_name in strategy_names:
+        mask, score, reason = _panel_strategy_hits(strategy_name, cols, symbols)
+        hits = []
+        for i in np.nonzero(mask & base_ok & (score > 0))[0]:
+            hits.append({
+                'symbol': symbols[i], # 股票代码
+                'name': names[i], # 股票名称
+                'score': round(float(score[i]), 1),
+                'reason': reason[i],
+                'close': float(cols['close'][i]), # 最新收盘价
+                'pct_chg': float(cols['pct_chg'][i]) # 涨跌幅
+            })
+        results[strategy_name] = sorted(hits, key=lambda x: x['score'], reverse=True)[:50]
+    return results
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "migrate":
+        ok, msg = migrate_history_to_parquet()
+        print(msg)
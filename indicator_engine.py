@@ -0,0 +1,223 @@
+import json
+import math
+import os
+import shutil
+from collections import deque
+import numpy as np
+import indicator_kernels
+
+# 增量指标引擎：按股票持久化 EMA 与滚动窗口状态，新增一根日线只需 O(1) 更新
+# 计算口径与 data_manager.calculate_indicators 保持一致（MA/MACD/KDJ/RSI/MACD_Cross）
+# 状态只为实际读取指标的股票（持仓/关注）维护：每日更新只递推已有状态，缺失的在 get_latest 时用向量化内核一次建好
+
+DATA_DIR = "data"
+STATE_DIR = os.path.join(DATA_DIR, "indicator_state")
+
+MA_WINDOWS = indicator_kernels.MA_WINDOWS
+KDJ_WINDOW = indicator_kernels.KDJ_WINDOW
+MIN_BARS = 30 # 与 calculate_indicators 一致：不足30根K线不输出指标
+
+ALPHA_12 = indicator_kernels.ALPHA_12
+ALPHA_26 = indicator_kernels.ALPHA_26
+ALPHA_KD = indicator_kernels.ALPHA_KD
+ALPHA_RSI = indicator_kernels.ALPHA_RSI
+_ema = indicator_kernels.ema_step
+
+class IndicatorState:
+    """单只股票的指标递推状态"""
+    def __init__(self):
+        self.count = 0
+        self.last_date = None
+        self.closes = deque(maxlen=max(MA_WINDOWS))
+        self.highs = deque(maxlen=KDJ_WINDOW)
+        self.lows = deque(maxlen=KDJ_WINDOW)
+        self.ema12 = None
+        self.ema26 = None
+        self.dea = None
+        self.k = None
+        self.d = None
+        self.rsi_up = None
+        self.rsi_down = None
+        self.prev_dif = None
+        self.prev_dea = None
+        self.values = {}
+
+    def update(self, trade_date, close, high, low):
+        """追加一根日线并刷新最新指标"""
+        prev_close = self.closes[-1] if self.closes else None
+        self.count += 1
+        self.last_date = int(trade_date)
+        self.closes.append(close)
+        self.highs.append(high)
+        self.lows.append(low)
+
+        values = {'close': close}
+        # 1. 移动平均线 (min_periods=1)
+        closes = list(self.closes)
+        for w in MA_WINDOWS:
+            window = closes[-w:]
+            values[f'MA{w}'] = sum(window) / len(window)
+
+        # 2. MACD
+        self.ema12, self.ema26, dif, self.dea = indicator_kernels.macd_step(self.ema12, self.ema26, self.dea, close)
+        values['DIF'] = dif
+        values['DEA'] = self.dea
+        values['MACD'] = 2 * (dif - self.dea)
+
+        # 3. KDJ (RSV 窗口不足9根时按50填充)
+        rsv = math.nan
+        if len(self.lows) == KDJ_WINDOW:
+            llv, hhv = min(self.lows), max(self.highs)
+            num, den = close - llv, hhv - llv
+            if den != 0:
+                rsv = num / den * 100
+            elif num != 0:
+                rsv = math.copysign(math.inf, num)
+        if math.isnan(rsv):
+            rsv = 50.0
+        self.k = _ema(self.k, rsv, ALPHA_KD)
+        self.d = _ema(self.d, self.k, ALPHA_KD)
+        values['K'] = self.k
+        values['D'] = self.d
+        values['J'] = 3 * self.k - 2 * self.d
+
+        # 4. RSI (首根K线无涨跌幅)
+        if prev_close is not None:
+            delta = close - prev_close
+            self.rsi_up = _ema(self.rsi_up, max(delta, 0.0), ALPHA_RSI)
+            self.rsi_down = _ema(self.rsi_down, max(-delta, 0.0), ALPHA_RSI)
+            rs = self.rsi_up / (self.rsi_down + 1e-10)
+            values['RSI'] = 100 - (100 / (1 + rs))
+        else:
+            values['RSI'] = math.nan
+
+        # 5. MACD 金叉/死叉
+        cross = 0
+        if self.prev_dif is not None:
+            if dif > self.dea and self.prev_dif <= self.prev_dea: cross = 1
+            elif dif < self.dea and self.prev_dif >= self.prev_dea: cross = -1
+        values['MACD_Cross'] = cross
+        self.prev_dif, self.prev_dea = dif, self.dea
+
+        self.values = values
+
+    def latest(self):
+        """最新一根K线的指标；数据不足 MIN_BARS 时只返回收盘价"""
+        if self.count < MIN_BARS:
+            return {'close': self.values.get('close', 0.0)} if self.values else {}
+        return dict(self.values)
+
+    def to_dict(self):
+        d = {k: v for k, v in self.__dict__.items() if not isinstance(v, deque)}
+        d.update({'closes': list(self.closes), 'highs': list(self.highs), 'lows': list(self.lows)})
+        return d
+
+    @classmethod
+    def from_dict(cls, d):
+        state = cls()
+        for k, v in d.items():
+            if k in ('closes', 'highs', 'lows'):
+                getattr(state, k).extend(v)
+            else:
+                setattr(state, k, v)
+        return state
+
+def _last(a):
+    return float(a[0, -1])
+
+def build_state(df):
+    """用完整历史（升序，含 trade_date/close/high/low 列）建立状态：整段历史走向量化内核，只取最后一根的递推量"""
+    state = IndicatorState()
+    n = len(df)
+    if n == 0:
+        return state
+    close, high, low = (df[c].to_numpy(dtype='float64')[None, :] for c in ('close', 'high', 'low'))
+    ind = indicator_kernels.compute(close, high, low)
+    state.count = n
+    state.last_date = int(df['trade_date'].iloc[-1])
+    state.closes.extend(float(x) for x in close[0, -max(MA_WINDOWS):])
+    state.highs.extend(float(x) for x in high[0, -KDJ_WINDOW:])
+    state.lows.extend(float(x) for x in low[0, -KDJ_WINDOW:])
+    state.ema12 = _last(indicator_kernels.ewm(close, ALPHA_12))
+    state.ema26 = _last(indicator_kernels.ewm(close, ALPHA_26))
+    state.dea, state.k, state.d = _last(ind['DEA']), _last(ind['K']), _last(ind['D'])
+    state.prev_dif, state.prev_dea = _last(ind['DIF']), state.dea
+    if n > 1:
+        delta = np.diff(close, axis=1)
+        state.rsi_up = _last(indicator_kernels.ewm(np.maximum(delta, 0.0), ALPHA_RSI))
+        state.rsi_down = _last(indicator_kernels.ewm(np.maximum(-delta, 0.0), ALPHA_RSI))
+    state.values = {'close': float(close[0, -1])}
+    for name in indicator_kernels.OUTPUTS:
+        state.values[name] = int(ind[name][0, -1]) if name == 'MACD_Cross' else _last(ind[name])
+    return state
+
+def _sync(state, history_df):
+    """
+    把状态推进到 history_df（写入后的完整历史）的最后一根：只递推 last_date 之后的新K线
+    状态与历史对不上（缺失、补写了更早的日期）时返回 None，由调用方重建
+    """
+    if state is None or state.last_date is None:
+        return None
+    dates = history_df['trade_date']
+    if int((dates <= state.last_date).sum()) != state.count:
+        return None
+    new_rows = history_df[dates > state.last_date]
+    for trade_date, close, high, low in zip(new_rows['trade_date'], new_rows['close'], new_rows['high'], new_rows['low']):
+        state.update(trade_date, float(close), float(high), float(low))
+    return state
+
+def _state_path(symbol):
+    return os.path.join(STATE_DIR, f"{symbol}.json")
+
+def load_state(symbol):
+    path = _state_path(symbol)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return IndicatorState.from_dict(json.load(f))
+    except Exception:
+        return None
+
+def save_state(symbol, state):
+    if not os.path.exists(STATE_DIR):
+        os.makedirs(STATE_DIR)
+    path = _state_path(symbol)
+    with open(path + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump(state.to_dict(), f)
+    os.replace(path + ".tmp", path)
+
+def reset_states():
+    """清空所有持久化状态（全量重新初始化历史数据后调用）"""
+    if os.path.exists(STATE_DIR):
+        shutil.rmtree(STATE_DIR)
+
+def append_bars(symbol, history_df):
+    """
+    历史数据写入后同步已有状态；没有状态的股票不处理（首次读取时再建），对不上的状态删除等待重建
+    history_df 为写入后的完整历史
+    """
+    state = load_state(symbol)
+    if state is None:
+        return None
+    state = _sync(state, history_df)
+    if state is None:
+        os.remove(_state_path(symbol))
+        return None
+    save_state(symbol, state)
+    return state
+
+def get_latest(symbol, load_history):
+    """
+    读取单只股票最新指标，load_history(symbol, columns=None) 返回历史（可只读部分列）
+    先只读 trade_date 校验状态；状态缺失或落后于已存储的历史（写入后同步失败）时，读完整历史递推/重建
+    """
+    state = load_state(symbol)
+    dates = load_history(symbol, columns=['trade_date'])
+    if dates is None or dates.empty:
+        return {}
+    if state is None or state.last_date != int(dates['trade_date'].iloc[-1]) or state.count != len(dates):
+        df = load_history(symbol)
+        state = _sync(state, df) or build_state(df)
+        save_state(symbol, state)
+    return state.latest()
@@ -0,0 +1,260 @@
+import importlib.util
+import numpy as np
+
+# 融合指标内核：在 (symbols × dates) 的二维 float64 数组上一次算出全部日线指标
+# 口径与 pandas 版 calculate_indicators 一致（MA5/10/20/60、DIF/DEA/MACD、KDJ、RSI14、MACD_Cross），误差在浮点精度内
+#   - 每行是一只股票的时间序列，首个有效收盘价之前的 NaN 视为填充（面板右对齐的空位），输出也为 NaN
+#   - 安装了 numba 时使用 JIT 编译的逐行单遍内核；否则用纯 NumPy：EWM 按分块闭式解沿时间轴整体求值，
+#     仅对中途有缺失值的行（EWM 需按 pandas 规则衰减权重）逐点递推
+# 单只股票传入 1 行的矩阵即可，全市场一次调用
+
+MA_WINDOWS = (5, 10, 20, 60)
+KDJ_WINDOW = 9
+VOL_WINDOW = 5
+
+ALPHA_12 = 2 / (12 + 1)
+ALPHA_26 = 2 / (26 + 1)
+ALPHA_9 = 2 / (9 + 1)
+ALPHA_KD = 1 / (1 + 2)   # com=2
+ALPHA_RSI = 1 / (1 + 13) # com=13
+
+OUTPUTS = tuple(f'MA{w}' for w in MA_WINDOWS) + ('DIF', 'DEA', 'MACD', 'K', 'D', 'J', 'RSI', 'MACD_Cross')
+HAS_NUMBA = importlib.util.find_spec("numba") is not None
+
+# --- 标量递推（增量引擎 indicator_engine 与分时 intraday 共用，保证三处口径一致） ---
+
+def ema_step(prev, x, alpha):
+    """adjust=False 的 EWM 单步递推，prev 为 None（尚无状态）时直接取 x"""
+    return x if prev is None else (1 - alpha) * prev + alpha * x
+
+def macd_step(ema12, ema26, dea, close):
+    """MACD(12,26,9) 单步递推，返回 (ema12, ema26, dif, dea)"""
+    ema12 = ema_step(ema12, close, ALPHA_12)
+    ema26 = ema_step(ema26, close, ALPHA_26)
+    dif = ema12 - ema26
+    return ema12, ema26, dif, ema_step(dea, dif, ALPHA_9)
+
+# --- 逐行单遍内核（numba 编译；未安装 numba 时作为含缺失值行的精确路径） ---
+
+def _ewm_step(weighted, old_wt, x, alpha):
+    """pandas ewm(adjust=False, ignore_na=False) 的单步递推，返回 (weighted, old_wt)"""
+    if weighted != weighted:
+        if x == x:
+            return x, 1.0
+        return weighted, old_wt
+    old_wt *= 1 - alpha
+    if x == x:
+        weighted = (old_wt * weighted + alpha * x) / (old_wt + alpha)
+        old_wt = 1.0
+    return weighted, old_wt
+
+def _fused_rows(close, high, low, out):
+    """out: (len(OUTPUTS), n, T)，逐行单遍算出全部指标"""
+    n, T = close.shape
+    nw = len(MA_WINDOWS)
+    nan = np.nan
+    for r in range(n):
+        start = T
+        for t in range(T):
+            if close[r, t] == close[r, t]:
+                start = t
+                break
+        for k in range(out.shape[0]):
+            for t in range(start):
+                out[k, r, t] = nan if k < out.shape[0] - 1 else 0.0
+        sums = np.zeros(nw)
+        counts = np.zeros(nw)
+        e12, w12, e26, w26, dea, wdea = nan, 1.0, nan, 1.0, nan, 1.0
+        kk, wk, dd, wd, up, wup, dn, wdn = nan, 1.0, nan, 1.0, nan, 1.0, nan, 1.0
+        prev_dif, prev_dea = nan, nan
+        for t in range(start, T):
+            c = close[r, t]
+            # 1. 移动平均 (min_periods=1，跳过缺失值)
+            for i in range(nw):
+                w = MA_WINDOWS[i]
+                if c == c:
+                    sums[i] += c
+                    counts[i] += 1
+                if t - w >= start:
+                    old = close[r, t - w]
+                    if old == old:
+                        sums[i] -= old
+                        counts[i] -= 1
+                out[i, r, t] = sums[i] / counts[i] if counts[i] > 0 else nan
+            # 2. MACD
+            e12, w12 = _ewm_step(e12, w12, c, ALPHA_12)
+            e26, w26 = _ewm_step(e26, w26, c, ALPHA_26)
+            dif = e12 - e26
+            dea, wdea = _ewm_step(dea, wdea, dif, ALPHA_9)
+            out[nw, r, t] = dif
+            out[nw + 1, r, t] = dea
+            out[nw + 2, r, t] = 2 * (dif - dea)
+            # 3. KDJ (窗口内须9根有效K线，否则 RSV 按50填充)
+            rsv = nan
+            if t - KDJ_WINDOW + 1 >= 0:
+                llv, hhv = np.inf, -np.inf
+                for j in range(t - KDJ_WINDOW + 1, t + 1):
+                    lo, hi = low[r, j], high[r, j]
+                    if lo != lo or hi != hi:
+                        llv = nan
+                        break
+                    llv = min(llv, lo)
+                    hhv = max(hhv, hi)
+                if llv == llv:
+                    num, den = c - llv, hhv - llv
+                    if den != 0:
+                        rsv = num / den * 100
+                    elif num > 0:
+                        rsv = np.inf
+                    elif num < 0:
+                        rsv = -np.inf
+            if rsv != rsv:
+                rsv = 50.0
+            kk, wk = _ewm_step(kk, wk, rsv, ALPHA_KD)
+            dd, wd = _ewm_step(dd, wd, kk, ALPHA_KD)
+            out[nw + 3, r, t] = kk
+            out[nw + 4, r, t] = dd
+            out[nw + 5, r, t] = 3 * kk - 2 * dd
+            # 4. RSI
+            delta = c - close[r, t - 1] if t > 0 else nan
+            up, wup = _ewm_step(up, wup, max(delta, 0.0) if delta == delta else nan, ALPHA_RSI)
+            dn, wdn = _ewm_step(dn, wdn, max(-delta, 0.0) if delta == delta else nan, ALPHA_RSI)
+            out[nw + 6, r, t] = 100 - 100 / (1 + up / (dn + 1e-10))
+            # 5. MACD 金叉/死叉
+            cross = 0.0
+            if dif > dea and prev_dif <= prev_dea: cross = 1.0
+            elif dif < dea and prev_dif >= prev_dea: cross = -1.0
+            out[nw + 7, r, t] = cross
+            prev_dif, prev_dea = dif, dea
+
+if HAS_NUMBA:
+    import numba
+    _ewm_step = numba.njit(cache=True)(_ewm_step)
+    _fused_rows = numba.njit(cache=True)(_fused_rows)
+
+# --- 纯 NumPy 路径 ---
+
+def _first_valid(x):
+    """各行首个非 NaN 的位置，全为 NaN 的行返回列数"""
+    valid = ~np.isnan(x)
+    return np.where(valid.any(axis=1), valid.argmax(axis=1), x.shape[1])
+
+def ewm(x, alpha, start=None):
+    """
+    沿时间轴的 ewm(adjust=False).mean()，要求 start 之后无缺失值
+    递推 y[t] = b*y[t-1] + a*x[t] 分块求闭式解：块内 cumsum，块间只递推一次进位；块长使 b^-L 不超过 1e3 以控制舍入误差
+    """
+    n, T = x.shape
+    if start is None:
+        start = _first_valid(x)
+    lead = np.arange(T)[None, :] < start[:, None]
+    first = x[np.arange(n), np.minimum(start, T - 1)] if T else np.zeros(n)
+    # 首个有效值回填到前面的空位：y 在空位上恒等于该值，之后的递推不受影响
+    x = np.where(lead, first[:, None], x)
+    beta = 1 - alpha
+    L = max(1, min(T, int(np.log(1e3) / -np.log(beta))))
+    nb = -(-T // L)
+    xb = np.zeros((n, nb * L))
+    xb[:, :T] = x
+    xb = xb.reshape(n, nb, L)
+    j = np.arange(L)
+    part = alpha * np.cumsum(xb * beta ** -j, axis=2) * beta ** j
+    carry = np.empty((n, nb))
+    c = first
+    for b in range(nb):
+        carry[:, b] = c
+        c = part[:, b, -1] + beta ** L * c
+    y = (part + beta ** (j + 1) * carry[:, :, None]).reshape(n, nb * L)[:, :T]
+    y[lead] = np.nan
+    # 起点精确取首个值（DIF/DEA 在起点恰为0，金叉判断依赖这一相等关系）
+    rows = np.nonzero(start < T)[0]
+    y[rows, start[rows]] = first[rows]
+    return y
+
+def rolling_mean(x, window, min_periods=1):
+    """rolling(window, min_periods).mean()，窗口内跳过缺失值"""
+    valid = ~np.isnan(x)
+    cs = np.cumsum(np.where(valid, x, 0.0), axis=1)
+    cn = np.cumsum(valid, axis=1)
+    cs[:, window:] = cs[:, window:] - cs[:, :-window].copy()
+    cn[:, window:] = cn[:, window:] - cn[:, :-window].copy()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(cn >= max(min_periods, 1), cs / cn, np.nan)
+
+def _rolling_extreme(x, window, func):
+    """rolling(window, min_periods=window).min()/max()：窗口内有缺失值即为 NaN（func 为 np.minimum/np.maximum，逐个平移比较）"""
+    out = np.full(x.shape, np.nan)
+    T = x.shape[1]
+    if T >= window:
+        acc = x[:, window - 1:].copy()
+        for k in range(1, window):
+            func(acc, x[:, window - 1 - k:T - k], out=acc)
+        out[:, window - 1:] = acc
+    return out
+
+def _compute_numpy(close, high, low):
+    n, T = close.shape
+    start = _first_valid(close)
+    lead = np.arange(T)[None, :] < start[:, None]
+    out = {}
+    for w in MA_WINDOWS:
+        out[f'MA{w}'] = rolling_mean(close, w)
+    dif = ewm(close, ALPHA_12, start) - ewm(close, ALPHA_26, start)
+    dea = ewm(dif, ALPHA_9, start)
+    out['DIF'], out['DEA'], out['MACD'] = dif, dea, 2 * (dif - dea)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        llv = _rolling_extreme(low, KDJ_WINDOW, np.minimum)
+        hhv = _rolling_extreme(high, KDJ_WINDOW, np.maximum)
+        rsv = (close - llv) / (hhv - llv) * 100
+    rsv = np.where(np.isnan(rsv) & ~lead, 50.0, rsv)
+    k = ewm(rsv, ALPHA_KD, start)
+    d = ewm(k, ALPHA_KD, start)
+    out['K'], out['D'], out['J'] = k, d, 3 * k - 2 * d
+
+    delta = np.full(close.shape, np.nan)
+    delta[:, 1:] = close[:, 1:] - close[:, :-1]
+    up = ewm(np.maximum(delta, 0.0), ALPHA_RSI, start + 1)
+    down = ewm(np.maximum(-delta, 0.0), ALPHA_RSI, start + 1)
+    out['RSI'] = 100 - 100 / (1 + up / (down + 1e-10))
+
+    prev_dif = np.full(close.shape, np.nan)
+    prev_dea = np.full(close.shape, np.nan)
+    prev_dif[:, 1:], prev_dea[:, 1:] = dif[:, :-1], dea[:, :-1]
+    with np.errstate(invalid='ignore'):
+        golden = (dif > dea) & (prev_dif <= prev_dea)
+        dead = (dif < dea) & (prev_dif >= prev_dea)
+    out['MACD_Cross'] = np.where(golden, 1, np.where(dead, -1, 0)).astype('int8')
+    return out
+
+def compute(close, high, low):
+    """
+    close/high/low: (symbols × dates) 数组（一维视为单只股票）
+    返回 {指标名: 同形状二维数组}，MACD_Cross 为 int8
+    """
+    close, high, low = (np.atleast_2d(np.asarray(a, dtype='float64')) for a in (close, high, low))
+    n, T = close.shape
+    if HAS_NUMBA:
+        buf = np.empty((len(OUTPUTS), n, T))
+        _fused_rows(np.ascontiguousarray(close), np.ascontiguousarray(high), np.ascontiguousarray(low), buf)
+        out = dict(zip(OUTPUTS, buf))
+        out['MACD_Cross'] = out['MACD_Cross'].astype('int8')
+        return out
+
+    out = _compute_numpy(close, high, low)
+    # 首个有效值之后仍有缺失的行：EWM 需按 pandas 规则衰减权重，逐点递推
+    start = _first_valid(close)
+    gaps = np.nonzero((np.isnan(close) & (np.arange(T)[None, :] >= start[:, None])).any(axis=1))[0]
+    if gaps.size:
+        buf = np.empty((len(OUTPUTS), gaps.size, T))
+        _fused_rows(close[gaps], high[gaps], low[gaps], buf)
+        for name, values in zip(OUTPUTS, buf):
+            out[name][gaps] = values
+    return out
+
+def volume_ratio(vol, window=VOL_WINDOW):
+    """量比：当日成交量 / 前 window 日均量（窗口须完整，与 rolling(window).mean().shift(1) 一致）"""
+    vol = np.atleast_2d(np.asarray(vol, dtype='float64'))
+    avg = np.full(vol.shape, np.nan)
+    avg[:, 1:] = rolling_mean(vol, window, min_periods=window)[:, :-1]
+    return vol / (avg + 1)
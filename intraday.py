@@ -0,0 +1,156 @@
+import os
+import threading
+import numpy as np
+import pandas as pd
+import data_manager
+import indicator_kernels
+
+# 盘中分时数据：采样实时行情聚合为 1 分钟 K 线，按股票存放在定长环形缓冲区（numpy 数组）
+# 分时 MACD（MACDFS）按已完成的分钟线递推 EMA，当前分钟用最新价临时计算，取特征为 O(1)
+# 收盘后落盘到 data/intraday/YYYYMMDD.parquet（无 pyarrow 时为 csv）
+
+INTRADAY_DIR = os.path.join(data_manager.DATA_DIR, "intraday")
+MAX_BARS = 241          # 一个交易日 240 分钟 + 集合竞价
+VOLUME_WINDOW = 5       # 分时量比：最近 N 分钟均量 / 全天分钟均量
+FIELDS = ("minute", "open", "high", "low", "close", "vol")
+F_MINUTE, F_OPEN, F_HIGH, F_LOW, F_CLOSE, F_VOL = range(len(FIELDS))
+# features() 输出的分时特征名（随每次行情采样变化，不参与 AI 决策缓存键）
+FEATURE_NAMES = ("MACDFS_DIF", "MACDFS_DEA", "MACDFS", "分时量", "分时量比")
+
+class MinuteBars:
+    """单只股票的分钟线环形缓冲区"""
+    def __init__(self, capacity=MAX_BARS):
+        self.capacity = capacity
+        self.data = np.zeros((capacity, len(FIELDS)), dtype=np.float64)
+        self.count = 0          # 已写入的分钟线总数（含被覆盖的）
+        self.last_cum_vol = None
+        self.total_vol = 0.0
+        # 已完成分钟线的 EMA 状态
+        self.ema12 = self.ema26 = self.dea = None
+
+    def _slot(self, i):
+        return i % self.capacity
+
+    def _close_bar(self):
+        """当前分钟结束，把其收盘价计入 EMA 状态"""
+        close = self.data[self._slot(self.count - 1), F_CLOSE]
+        self.ema12, self.ema26, _, self.dea = indicator_kernels.macd_step(self.ema12, self.ema26, self.dea, close)
+
+    def update(self, minute, price, cum_vol):
+        """
+        追加一次行情采样
+        minute: 分钟序号（如 HHMM 整数），cum_vol: 当日累计成交量
+        """
+        delta = 0.0 if self.last_cum_vol is None else max(0.0, cum_vol - self.last_cum_vol)
+        self.last_cum_vol = cum_vol
+        self.total_vol += delta
+        if self.count and self.data[self._slot(self.count - 1), F_MINUTE] == minute:
+            row = self.data[self._slot(self.count - 1)]
+            row[F_HIGH] = max(row[F_HIGH], price)
+            row[F_LOW] = min(row[F_LOW], price)
+            row[F_CLOSE] = price
+            row[F_VOL] += delta
+            return
+        if self.count:
+            self._close_bar()
+        self.data[self._slot(self.count)] = (minute, price, price, price, price, delta)
+        self.count += 1
+
+    def bars(self):
+        """按时间顺序返回缓冲区内的分钟线（二维数组副本）"""
+        n = min(self.count, self.capacity)
+        start = self._slot(self.count - n)
+        return np.concatenate([self.data[start:start + n], self.data[:max(0, start + n - self.capacity)]])
+
+    def features(self):
+        """分时 MACD 与分时量特征"""
+        if not self.count:
+            return {}
+        last = self.data[self._slot(self.count - 1)]
+        _, _, dif, dea = indicator_kernels.macd_step(self.ema12, self.ema26, self.dea, float(last[F_CLOSE]))
+        n = min(self.count, VOLUME_WINDOW, self.capacity)
+        recent = [float(self.data[self._slot(self.count - 1 - i), F_VOL]) for i in range(n)]
+        day_avg = self.total_vol / self.count
+        return {
+            'MACDFS_DIF': round(dif, 4),
+            'MACDFS_DEA': round(dea, 4),
+            'MACDFS': round(2 * (dif - dea), 4),
+            '分时量': float(last[F_VOL]),
+            '分时量比': round(sum(recent) / n / day_avg, 2) if day_avg > 0 else 0.0,
+        }
+
+def _quote_minute(q):
+    """行情时间 HH:MM:SS -> HHMM 整数；不在交易时段内返回 None"""
+    try:
+        hh, mm = str(q.get('time', '')).split(':')[:2]
+        minute = int(hh) * 100 + int(mm)
+    except ValueError:
+        return None
+    if 925 <= minute < 1131 or 1300 <= minute < 1501:
+        return min(minute, 1129) if minute < 1300 else min(minute, 1459)
+    return None
+
+class IntradayCollector:
+    """按交易日收集分钟线；换日或收盘时调用 flush 落盘"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.date = None
+        self.buffers = {}
+
+    def on_quotes(self, quotes):
+        """喂入一批实时行情 {symbol: quote}（来自 data_manager.get_realtime_quotes）"""
+        with self.lock:
+            for symbol, q in quotes.items():
+                minute = _quote_minute(q)
+                price = float(q.get('price', 0) or 0)
+                if minute is None or price <= 0.01: continue
+                date = str(q.get('date', '')).replace('-', '')
+                if self.date is not None and date != self.date:
+                    self._flush_locked()
+                self.date = date
+                buf = self.buffers.get(symbol)
+                if buf is None:
+                    buf = self.buffers[symbol] = MinuteBars()
+                buf.update(minute, price, float(q.get('vol', 0) or 0))
+
+    def features(self, symbol):
+        with self.lock:
+            buf = self.buffers.get(symbol)
+            return buf.features() if buf is not None else {}
+
+    def _flush_locked(self):
+        if not self.buffers or not self.date:
+            return None
+        frames = []
+        for symbol, buf in self.buffers.items():
+            df = pd.DataFrame(buf.bars(), columns=FIELDS)
+            df.insert(0, 'symbol', symbol)
+            frames.append(df)
+        df = pd.concat(frames, ignore_index=True)
+        df['minute'] = df['minute'].astype('int32')
+        if not os.path.exists(INTRADAY_DIR):
+            os.makedirs(INTRADAY_DIR)
+        path = os.path.join(INTRADAY_DIR, f"{self.date}.{data_manager.HISTORY_FORMAT}")
+        if data_manager.HISTORY_FORMAT == "parquet":
+            df.to_parquet(path + ".tmp", index=False)
+        else:
+            df.to_csv(path + ".tmp", index=False)
+        os.replace(path + ".tmp", path)
+        print(f"分时数据已落盘: {path} ({len(self.buffers)} 只股票)")
+        self.buffers = {}
+        self.date = None
+        return path
+
+    def flush(self):
+        """落盘并清空当日缓冲区，无数据时返回 None"""
+        with self.lock:
+            return self._flush_locked()
+
+def load_intraday(date, symbol=None):
+    """读取已落盘的某日分钟线"""
+    path = os.path.join(INTRADAY_DIR, f"{date}.{data_manager.HISTORY_FORMAT}")
+    if not os.path.exists(path): return pd.DataFrame(columns=('symbol',) + FIELDS)
+    df = pd.read_parquet(path) if data_manager.HISTORY_FORMAT == "parquet" else pd.read_csv(path, dtype={'symbol': str})
+    return df[df['symbol'] == symbol].reset_index(drop=True) if symbol else df
+
+collector = IntradayCollector()
@@ -0,0 +1,197 @@
+import atexit
+import bisect
+import json
+import os
+import sys
+import threading
+import time
+
+# 轻量性能埋点：耗时区间（span）聚合为分段延迟直方图，另有计数器（API 调用、重试、Token 切换、缓存命中等）
+# 每个进程写自己的文件 data/metrics/<进程名>-<pid>.json（后台线程定期落盘），诊断页合并所有文件展示
+# 关闭时 span() 直接返回共享的空上下文，开销只有一次函数调用和一次布尔判断
+
+DATA_DIR = "data"
+METRICS_DIR = os.path.join(DATA_DIR, "metrics")
+FLUSH_INTERVAL = 10        # 落盘间隔（秒）
+RETENTION_DAYS = 7         # 超过该天数未更新的进程文件在落盘时清理
+# 直方图桶上界（毫秒），最后一个桶为 +inf
+BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000, 120000]
+
+_enabled = os.environ.get("SMARTQUANT_METRICS", "1") != "0"
+_lock = threading.Lock()
+_histograms = {} # name -> {'count', 'sum', 'min', 'max', 'buckets'}
+_counters = {}
+_dirty = False
+_process_name = os.path.splitext(os.path.basename(sys.argv[0] or "python"))[0] or "python"
+_started = time.time()
+_flusher = None
+
+def set_enabled(enabled):
+    global _enabled
+    _enabled = bool(enabled)
+
+def is_enabled():
+    return _enabled
+
+def set_process_name(name):
+    """指定本进程的指标文件名前缀（如 app / scheduler）"""
+    global _process_name
+    _process_name = name
+
+class _NoopSpan:
+    def __enter__(self): return self
+    def __exit__(self, *exc): return False
+
+_NOOP = _NoopSpan()
+
+class _Span:
+    __slots__ = ('name', 't0')
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        observe(self.name, time.perf_counter() - self.t0)
+        if exc_type is not None:
+            incr(self.name + ".errors")
+        return False
+
+def span(name):
+    """with metrics.span("ai_job.llm"): ... 记录该段代码耗时"""
+    return _Span(name) if _enabled else _NOOP
+
+def timed(name):
+    """函数装饰器版本的 span"""
+    def decorator(func):
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        wrapper.__name__, wrapper.__doc__ = func.__name__, func.__doc__
+        return wrapper
+    return decorator
+
+def _ensure_flusher():
+    global _flusher
+    if _flusher is None:
+        _flusher = threading.Thread(target=_flush_loop, name="MetricsFlusher", daemon=True)
+        _flusher.start()
+
+def observe(name, seconds):
+    global _dirty
+    if not _enabled: return
+    ms = seconds * 1000
+    with _lock:
+        h = _histograms.get(name)
+        if h is None:
+            h = _histograms[name] = {'count': 0, 'sum': 0.0, 'min': ms, 'max': ms, 'buckets': [0] * (len(BUCKETS_MS) + 1)}
+        h['count'] += 1
+        h['sum'] += ms
+        h['min'] = min(h['min'], ms)
+        h['max'] = max(h['max'], ms)
+        h['buckets'][bisect.bisect_left(BUCKETS_MS, ms)] += 1
+        _dirty = True
+    _ensure_flusher()
+
+def incr(name, n=1):
+    global _dirty
+    if not _enabled: return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+        _dirty = True
+    _ensure_flusher()
+
+def snapshot():
+    with _lock:
+        return {
+            'process': _process_name,
+            'pid': os.getpid(),
+            'started': _started,
+            'updated': time.time(),
+            'histograms': {k: dict(v, buckets=list(v['buckets'])) for k, v in _histograms.items()},
+            'counters': dict(_counters),
+        }
+
+def _path():
+    return os.path.join(METRICS_DIR, f"{_process_name}-{os.getpid()}.json")
+
+def flush():
+    """写入本进程指标文件（原子替换），同时清理过期的其他进程文件"""
+    global _dirty
+    with _lock:
+        if not _dirty: return
+        _dirty = False
+    data = snapshot()
+    try:
+        if not os.path.exists(METRICS_DIR):
+            os.makedirs(METRICS_DIR)
+        path = _path()
+        with open(path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+        cutoff = time.time() - RETENTION_DAYS * 86400
+        for name in os.listdir(METRICS_DIR):
+            p = os.path.join(METRICS_DIR, name)
+            if p != path and os.path.getmtime(p) < cutoff:
+                os.remove(p)
+    except Exception as e:
+        print(f"指标落盘失败: {e}")
+
+def _flush_loop():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        flush()
+
+atexit.register(flush)
+
+def percentile(h, q):
+    """按直方图桶估算分位数（毫秒），返回所在桶的上界"""
+    if not h['count']: return 0.0
+    target = q * h['count']
+    seen = 0
+    for i, c in enumerate(h['buckets']):
+        seen += c
+        if seen >= target:
+            return min(BUCKETS_MS[i], h['max']) if i < len(BUCKETS_MS) else h['max']
+    return h['max']
+
+def load_all():
+    """合并 data/metrics 下所有进程文件，返回 (histograms, counters, processes)"""
+    histograms, counters, processes = {}, {}, []
+    if not os.path.exists(METRICS_DIR):
+        return histograms, counters, processes
+    for name in sorted(os.listdir(METRICS_DIR)):
+        if not name.endswith(".json"): continue
+        try:
+            with open(os.path.join(METRICS_DIR, name), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception:
+            continue
+        processes.append({'process': data.get('process'), 'pid': data.get('pid'), 'updated': data.get('updated')})
+        for k, v in data.get('counters', {}).items():
+            counters[k] = counters.get(k, 0) + v
+        for k, h in data.get('histograms', {}).items():
+            m = histograms.get(k)
+            if m is None:
+                histograms[k] = dict(h, buckets=list(h['buckets']))
+                continue
+            m['count'] += h['count']
+            m['sum'] += h['sum']
+            m['min'] = min(m['min'], h['min'])
+            m['max'] = max(m['max'], h['max'])
+            m['buckets'] = [a + b for a, b in zip(m['buckets'], h['buckets'])]
+    return histograms, counters, processes
+
+def reset_all():
+    """清空本进程内存中的指标并删除所有进程文件（其他进程下次落盘时会写回各自内存中的累计值）"""
+    global _dirty
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+        _dirty = False
+    if os.path.exists(METRICS_DIR):
+        for name in os.listdir(METRICS_DIR):
+            try: os.remove(os.path.join(METRICS_DIR, name))
+            except OSError: pass
@@ -1,123 +1,157 @@
 import json
 import os
-from datetime import datetime, timedelta
+import sqlite3
+import threading
+from datetime import datetime
 
 DATA_DIR = "data"
-PORTFOLIO_FILE = os.path.join(DATA_DIR, "portfolio.json")
+PORTFOLIO_FILE = os.path.join(DATA_DIR, "portfolio.json") # 旧版 JSON 存储，首次启动时导入
+PORTFOLIO_DB = os.path.join(DATA_DIR, "portfolio.db")
+DEFAULT_CASH = 100000.0
 
 if not os.path.exists(DATA_DIR):
     os.makedirs(DATA_DIR)
 
-def load_portfolio():
-    """加载并处理 T+1 逻辑，增加旧数据结构兼容性处理"""
-    if not os.path.exists(PORTFOLIO_FILE):
-        return {"cash": 100000.0, "holdings": []}
-    
+# 持仓存储（SQLite WAL）：Streamlit 前端与调度器进程并发读写，单条 upsert 按主键定位，多条更新在同一事务内完成
+# T+1 可用股数在读取时按 locked_date 计算，不再回写
+_local = threading.local()
+_init_lock = threading.Lock()
+
+def _conn():
+    """每个线程独立的 SQLite 连接，首次连接时建表并导入旧 JSON"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(PORTFOLIO_DB, timeout=10, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        with _init_lock:
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            conn.execute("""CREATE TABLE IF NOT EXISTS holdings (
+                symbol TEXT PRIMARY KEY, name TEXT, total_shares INTEGER NOT NULL DEFAULT 0,
+                cost REAL NOT NULL DEFAULT 0, locked_shares INTEGER NOT NULL DEFAULT 0,
+                locked_date TEXT NOT NULL DEFAULT '2000-01-01')""")
+            conn.execute("""CREATE TABLE IF NOT EXISTS trades (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, ts TEXT NOT NULL, symbol TEXT NOT NULL, action TEXT NOT NULL,
+                delta_shares INTEGER NOT NULL, total_shares INTEGER NOT NULL, cost REAL NOT NULL)""")
+            _import_json(conn)
+        _local.conn = conn
+    return conn
+
+class _transaction:
+    """BEGIN IMMEDIATE 写事务，异常时回滚"""
+    def __enter__(self):
+        self.conn = _conn()
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
+
+def _import_json(conn):
+    """一次性导入旧版 portfolio.json（保留原文件），导入标记写入 meta"""
+    conn.execute("BEGIN IMMEDIATE")
     try:
-        with open(PORTFOLIO_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            
-        today = datetime.now().date()
-        migrated = False # 标记是否发生了数据迁移
-        
-        # --- 兼容性检查和迁移 ---
-        new_holdings = []
-        for h in data.get('holdings', []):
-            
-            # --- 数据兼容与初始化 ---
-            if 'total_shares' not in h: h['total_shares'] = h.get('shares', 0)
-            if 'locked_shares' not in h: h['locked_shares'] = 0
-            if 'locked_date' not in h: h['locked_date'] = "2000-01-01"
-            if 'cost' not in h: h['cost'] = 0.0 # 确保成本字段存在
-            
-            # --- T+1 刷新逻辑 (使用 locked_shares) ---
-            avail_shares = h['total_shares']
-            
-            if h['total_shares'] > 0:
-                locked_date = datetime.strptime(h['locked_date'], "%Y-%m-%d").date()
-                
-                # 如果锁定日期是今天，则锁定股数不可用
-                if locked_date == today:
-                    # 可用股数 = 总股数 - 锁定的股数 (即 T0 买入的股数)
-                    avail_shares = max(0, h['total_shares'] - h['locked_shares'])
-                else:
-                    # 否则，锁定股数清零，所有股数均可用
-                    h['locked_shares'] = 0
-                    
-            h['avail_shares'] = avail_shares
-            new_holdings.append(h)
-            
-        data['holdings'] = new_holdings
-        # 不再进行 save_portfolio(data)，避免频繁写入
-        
-        return data
-        
-    except Exception as e:
-        # 如果 JSON 文件完全损坏或格式错误，则返回空
-        print(f"致命错误: 无法解析 portfolio.json 文件。将返回空持仓。错误: {e}")
-        return {"cash": 100000.0, "holdings": []}
+        if conn.execute("SELECT 1 FROM meta WHERE key = 'json_imported'").fetchone():
+            conn.execute("COMMIT")
+            return
+        cash = DEFAULT_CASH
+        if os.path.exists(PORTFOLIO_FILE):
+            try:
+                with open(PORTFOLIO_FILE, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                cash = float(data.get('cash', DEFAULT_CASH))
+                for h in data.get('holdings', []):
+                    conn.execute("INSERT OR REPLACE INTO holdings (symbol, name, total_shares, cost, locked_shares, locked_date) VALUES (?, ?, ?, ?, ?, ?)",
+                                 (h['symbol'], h.get('name', ''), int(h.get('total_shares', h.get('shares', 0))), float(h.get('cost', 0.0)),
+                                  int(h.get('locked_shares', 0)), h.get('locked_date', "2000-01-01")))
+                print(f"已从 {PORTFOLIO_FILE} 导入 {len(data.get('holdings', []))} 条持仓")
+            except Exception as e:
+                print(f"致命错误: 无法解析 portfolio.json 文件，跳过导入。错误: {e}")
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('cash', ?)", (str(cash),))
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('json_imported', ?)", (datetime.now().isoformat(),))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+def load_portfolio():
+    """加载持仓并计算 T+1 可用股数：锁定日期是今天时锁定股数不可用，否则全部可用"""
+    conn = _conn()
+    today = datetime.now().date().strftime("%Y-%m-%d")
+    row = conn.execute("SELECT value FROM meta WHERE key = 'cash'").fetchone()
+    cash = float(row['value']) if row else DEFAULT_CASH
+    holdings = []
+    for r in conn.execute("SELECT * FROM holdings ORDER BY rowid"):
+        h = dict(r)
+        if h['total_shares'] > 0 and h['locked_date'] == today:
+            h['avail_shares'] = max(0, h['total_shares'] - h['locked_shares'])
+        else:
+            h['locked_shares'] = 0
+            h['avail_shares'] = h['total_shares']
+        holdings.append(h)
+    return {"cash": cash, "holdings": holdings}
 
 def save_portfolio(data):
-    with open(PORTFOLIO_FILE, 'w', encoding='utf-8') as f:
-        json.dump(data, f, indent=4, ensure_ascii=False)
+    """整体覆盖写入（兼容旧接口）"""
+    with _transaction() as conn:
+        conn.execute("DELETE FROM holdings")
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('cash', ?)", (str(float(data.get('cash', DEFAULT_CASH))),))
+        for h in data.get('holdings', []):
+            conn.execute("INSERT OR REPLACE INTO holdings (symbol, name, total_shares, cost, locked_shares, locked_date) VALUES (?, ?, ?, ?, ?, ?)",
+                         (h['symbol'], h.get('name', ''), int(h.get('total_shares', 0)), float(h.get('cost', 0.0)),
+                          int(h.get('locked_shares', 0)), h.get('locked_date', "2000-01-01")))
 
 def update_cash(amount):
     """手动维护现金"""
-    data = load_portfolio()
-    data['cash'] = float(amount)
-    save_portfolio(data)
+    with _transaction() as conn:
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('cash', ?)", (str(float(amount)),))
+
+def _upsert(conn, symbol, name, total_shares, avail_shares, cost, buy_date_str):
+    total_shares = int(total_shares)
+    # 计算锁定股数 (T0 买入股数)，<= 0 时全部可用
+    locked_qty = max(0, total_shares - int(avail_shares))
+    row = conn.execute("SELECT total_shares FROM holdings WHERE symbol = ?", (symbol,)).fetchone()
+    conn.execute("""INSERT INTO holdings (symbol, name, total_shares, cost, locked_shares, locked_date) VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(symbol) DO UPDATE SET name = excluded.name, total_shares = excluded.total_shares,
+                    cost = excluded.cost, locked_shares = excluded.locked_shares, locked_date = excluded.locked_date""",
+                 (symbol, name, total_shares, float(cost), locked_qty, buy_date_str))
+    # 流水：按持股数变化记为买入/卖出，仅校准成本或新增关注记为调整
+    delta = total_shares - (row['total_shares'] if row else 0)
+    action = "BUY" if delta > 0 else ("SELL" if delta < 0 else "ADJUST")
+    conn.execute("INSERT INTO trades (ts, symbol, action, delta_shares, total_shares, cost) VALUES (?, ?, ?, ?, ?, ?)",
+                 (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), symbol, action, delta, total_shares, float(cost)))
 
 def upsert_holding(symbol, name, total_shares, avail_shares, cost, buy_date_str):
     """
     新增或更新持仓 (库存校准模式)
     """
-    data = load_portfolio()
-    holdings = data['holdings']
-    
-    # 计算锁定股数 (T0 买入股数)
-    locked_qty = int(total_shares) - int(avail_shares)
-    
-    # if total_shares <= 0:
-    #     # 清仓/删除操作
-    #     data['holdings'] = [h for h in holdings if h['symbol'] != symbol]
-    #     save_portfolio(data)
-    #     return True
-        
-    # 查找是否存在
-    existing = next((h for h in holdings if h['symbol'] == symbol), None)
-    
-    if existing:
-        # 更新逻辑
-        existing['name'] = name
-        existing['total_shares'] = int(total_shares)
-        existing['cost'] = float(cost)
-        existing['locked_date'] = buy_date_str
-        # 锁定股数和日期
-        if locked_qty > 0:
-            existing['locked_shares'] = locked_qty
-            
-        else:
-            # 如果锁定股数 <= 0，则全部可用
-            existing['locked_shares'] = 0 
-            
-    else:
-        # 新增逻辑
-        new_item = {
-            "symbol": symbol,
-            "name": name,
-            "total_shares": int(total_shares),
-            "cost": float(cost),
-            "locked_shares": max(0, locked_qty),
-            "locked_date": buy_date_str,
-            "avail_shares": int(avail_shares) # 仅用于初始化，下次加载时会被重算
-        }
-        holdings.append(new_item)
-        
-    save_portfolio(data)
+    with _transaction() as conn:
+        _upsert(conn, symbol, name, total_shares, avail_shares, cost, buy_date_str)
+    return True
+
+def upsert_holdings(items):
+    """
+    批量新增或更新持仓，同一事务内完成
+    items: [(symbol, name, total_shares, avail_shares, cost, buy_date_str), ...]
+    """
+    with _transaction() as conn:
+        for item in items:
+            _upsert(conn, *item)
     return True
 
 def delete_holding(symbol):
-    data = load_portfolio()
-    data['holdings'] = [h for h in data['holdings'] if h['symbol'] != symbol]
-    save_portfolio(data)
-    return True
\ No newline at end of file
+    with _transaction() as conn:
+        row = conn.execute("SELECT total_shares, cost FROM holdings WHERE symbol = ?", (symbol,)).fetchone()
+        if row:
+            conn.execute("DELETE FROM holdings WHERE symbol = ?", (symbol,))
+            conn.execute("INSERT INTO trades (ts, symbol, action, delta_shares, total_shares, cost) VALUES (?, ?, ?, ?, ?, ?)",
+                         (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), symbol, "DELETE", -row['total_shares'], 0, row['cost']))
+    return True
+
+def load_trades(symbol=None, limit=200):
+    """读取持仓变动流水，按时间倒序"""
+    sql = "SELECT * FROM trades" + (" WHERE symbol = ?" if symbol else "") + " ORDER BY id DESC LIMIT ?"
+    params = ([symbol] if symbol else []) + [int(limit)]
+    return [dict(r) for r in _conn().execute(sql, params)]
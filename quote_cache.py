@@ -0,0 +1,188 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import metrics
+
+# 跨进程共享的行情 TTL 缓存（SQLite WAL），供 Streamlit 前端与 ai_scheduler 后台进程共用
+# 同一批代码并发请求时只发起一次网络调用（single-flight）：
+#   - 进程内：同一 key 只有一个线程负责抓取，其余线程等待其结果
+#   - 跨进程：通过 leases 表抢占抓取租约，未抢到的进程轮询等待缓存写入，租约过期则自行抓取
+
+DATA_DIR = "data"
+CACHE_FILE = os.path.join(DATA_DIR, "quote_cache.db")
+
+DEFAULT_TTL = 3.0      # 行情缓存有效期（秒）
+LEASE_SECONDS = 5.0    # 抓取租约时长，持有者崩溃后最多阻塞其他进程这么久
+POLL_INTERVAL = 0.05   # 等待其他进程写入缓存时的轮询间隔
+SQL_BATCH = 500        # 单条 SQL 中 IN (...) 的参数上限
+
+class QuoteCache:
+    def __init__(self, path=CACHE_FILE, ttl=DEFAULT_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._inflight = {} # key -> threading.Event，本进程内正在抓取的 key
+        self._local = threading.local()
+        self._owner = f"{os.getpid()}"
+        self.stats = {'hits': 0, 'misses': 0, 'coalesced': 0, 'fetches': 0}
+
+    def _conn(self):
+        """每个线程独立的 SQLite 连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS quotes (key TEXT PRIMARY KEY, value TEXT NOT NULL, ts REAL NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS leases (key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL)")
+            self._local.conn = conn
+        return conn
+
+    def _count(self, name, n):
+        """本进程统计 + 跨进程埋点（quote_cache.hits/misses/coalesced/fetches，在性能诊断页汇总）"""
+        with self._lock:
+            self.stats[name] += n
+        metrics.incr(f"quote_cache.{name}", n)
+
+    def _read(self, keys, ttl):
+        """读取未过期的缓存项"""
+        found = {}
+        conn = self._conn()
+        since = time.time() - ttl
+        for i in range(0, len(keys), SQL_BATCH):
+            batch = keys[i:i + SQL_BATCH]
+            marks = ",".join("?" * len(batch))
+            for key, value in conn.execute(f"SELECT key, value FROM quotes WHERE ts >= ? AND key IN ({marks})", [since] + batch):
+                found[key] = json.loads(value)
+        return found
+
+    def _write(self, values):
+        now = time.time()
+        self._conn().executemany("INSERT OR REPLACE INTO quotes (key, value, ts) VALUES (?, ?, ?)",
+                                 [(k, json.dumps(v, ensure_ascii=False), now) for k, v in values.items()])
+
+    def _claim(self, keys):
+        """抢占跨进程抓取租约，返回本进程抢到的 key"""
+        conn = self._conn()
+        now = time.time()
+        claimed = []
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM leases WHERE expires < ?", (now,))
+            for key in keys:
+                cur = conn.execute("INSERT OR IGNORE INTO leases (key, owner, expires) VALUES (?, ?, ?)",
+                                   (key, self._owner, now + LEASE_SECONDS))
+                if cur.rowcount == 1: claimed.append(key)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return claimed
+
+    def _release(self, keys):
+        conn = self._conn()
+        for i in range(0, len(keys), SQL_BATCH):
+            batch = keys[i:i + SQL_BATCH]
+            marks = ",".join("?" * len(batch))
+            conn.execute(f"DELETE FROM leases WHERE owner = ? AND key IN ({marks})", [self._owner] + batch)
+
+    def _fetch(self, keys, fetch_many):
+        values = fetch_many(keys)
+        self._count('fetches', 1)
+        if values:
+            self._write(values)
+        return values
+
+    def _leased(self, keys):
+        """仍被其他进程持有（未过期）租约的 key"""
+        conn = self._conn()
+        now = time.time()
+        held = set()
+        for i in range(0, len(keys), SQL_BATCH):
+            batch = keys[i:i + SQL_BATCH]
+            marks = ",".join("?" * len(batch))
+            for (key,) in conn.execute(f"SELECT key FROM leases WHERE expires >= ? AND key IN ({marks})", [now] + batch):
+                held.add(key)
+        return held
+
+    def _wait_other_process(self, keys, ttl):
+        """
+        等待其他进程写入缓存，未写入的 key 不返回：
+        持有者先写缓存再释放租约，因此租约已释放（抓取失败）或到期时立即停止等待，由调用方自行抓取
+        """
+        deadline = time.time() + LEASE_SECONDS
+        found = {}
+        pending = list(keys)
+        while pending and time.time() < deadline:
+            time.sleep(POLL_INTERVAL)
+            held = self._leased(pending) # 先查租约再读缓存，避免漏掉释放前刚写入的结果
+            found.update(self._read(pending, ttl))
+            pending = [k for k in pending if k not in found and k in held]
+        return found
+
+    def get_many(self, keys, fetch_many, ttl=None):
+        """
+        批量读取缓存，未命中部分调用 fetch_many(keys) -> {key: value} 抓取并写回
+        fetch_many 只需返回成功的项，失败的 key 不会被缓存
+        """
+        ttl = self.ttl if ttl is None else ttl
+        keys = list(dict.fromkeys(keys))
+        result = self._read(keys, ttl) if ttl > 0 else {}
+        self._count('hits', len(result))
+        missing = [k for k in keys if k not in result]
+        if not missing:
+            return result
+        self._count('misses', len(missing))
+        if ttl <= 0:
+            return {**result, **self._fetch(missing, fetch_many)}
+
+        # 1. 进程内 single-flight：已有线程在抓的 key 只等待
+        owned, waiting = [], []
+        with self._lock:
+            for key in missing:
+                event = self._inflight.get(key)
+                if event is None:
+                    self._inflight[key] = threading.Event()
+                    owned.append(key)
+                else:
+                    waiting.append((key, event))
+
+        try:
+            if owned:
+                # 2. 跨进程 single-flight：抢到租约的自己抓，其余等待持有租约的进程
+                claimed = self._claim(owned)
+                others = [k for k in owned if k not in claimed]
+                if claimed:
+                    try:
+                        result.update(self._fetch(claimed, fetch_many))
+                    finally:
+                        self._release(claimed)
+                if others:
+                    shared = self._wait_other_process(others, ttl)
+                    self._count('coalesced', len(shared))
+                    result.update(shared)
+                    still = [k for k in others if k not in shared]
+                    if still:
+                        result.update(self._fetch(still, fetch_many))
+        finally:
+            with self._lock:
+                for key in owned:
+                    self._inflight.pop(key).set()
+
+        if waiting:
+            for _, event in waiting:
+                event.wait(LEASE_SECONDS)
+            waited_keys = [k for k, _ in waiting]
+            shared = self._read(waited_keys, ttl)
+            self._count('coalesced', len(shared))
+            result.update(shared)
+            still = [k for k in waited_keys if k not in shared]
+            if still:
+                result.update(self._fetch(still, fetch_many))
+        return result
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats)
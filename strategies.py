@@ -0,0 +1,202 @@
+import ast
+import importlib.util
+import json
+import os
+import string
+import threading
+import numpy as np
+import config_service
+
+# 声明式选股策略注册表
+# 策略 = 若干条规则，按顺序匹配（先命中者生效，相当于 if/elif）；每条规则包含：
+#   when:   条件表达式，如 "3 < pct_chg < 8 and vol_ratio > 1.8 and close > MA5"
+#   score:  得分表达式，如 "80 + minimum(vol_ratio * 2, 15)"，得分 <= 0 视为未命中
+#   reason: 理由模板，如 "量比{vol_ratio:.1f} 趋势向上"，只对命中的股票格式化
+# 表达式经 AST 校验后编译一次，对全市场（一维：最新K线；二维：面板全部交易日）整体求值
+# 安装了 numexpr 时优先用 numexpr 求值，不支持的函数自动回退到 NumPy
+# 内置策略之外，可在 data/strategies.json 中新增或覆盖同名策略，无需修改代码：
+#   {"strategies": [{"name": "...", "label": "...", "scan": true, "rules": [{"when": "...", "score": "...", "reason": "..."}]}]}
+
+DATA_DIR = "data"
+STRATEGY_FILE = os.path.join(DATA_DIR, "strategies.json")
+
+BUILTIN_STRATEGIES = [
+    {
+        "name": "overnight",
+        "label": "🌙 一夜持股法",
+        "scan": True,
+        "rules": [
+            # 涨幅在3%-8%之间，放量1.8倍以上，收盘价站上MA5且处于上升趋势；量比越大权重越高，最高加15分
+            {"when": "3 < pct_chg < 8 and vol_ratio > 1.8 and close > MA5 and DIF > 0",
+             "score": "80 + minimum(vol_ratio * 2, 15)",
+             "reason": "量比{vol_ratio:.1f} 趋势向上"},
+        ],
+    },
+    {
+        "name": "limit_up",
+        "label": "🚀 打板策略",
+        "scan": True,
+        "rules": [
+            # A股主板涨停一般 > 9.9%，创业板 > 19.9%
+            {"when": "is_main and pct_chg > 9.8", "score": "95", "reason": "主板涨停"},
+            {"when": "is_gem and pct_chg > 19.8", "score": "98", "reason": "双创涨停"},
+        ],
+    },
+]
+
+# 可在表达式中使用的列：行情字段 + 指标 + 板块标记（由股票代码推出）
+BOARD_COLUMNS = ("is_main", "is_gem")
+NUMPY_FUNCS = {
+    "abs": np.abs, "minimum": np.minimum, "maximum": np.maximum,
+    "where": np.where, "log": np.log, "sqrt": np.sqrt, "isnan": np.isnan,
+}
+NUMEXPR_FUNCS = {"abs", "where", "log", "sqrt"}
+# 生成 numexpr 文本需要 ast.unparse（Python 3.9+），3.8 下直接用 NumPy 求值
+HAS_NUMEXPR = hasattr(ast, "unparse") and importlib.util.find_spec("numexpr") is not None
+
+_ALLOWED_NODES = (
+    ast.Expression, ast.BoolOp, ast.And, ast.Or, ast.UnaryOp, ast.Not, ast.USub, ast.UAdd, ast.Invert,
+    ast.BinOp, ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.Mod, ast.BitAnd, ast.BitOr,
+    ast.Compare, ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.Eq, ast.NotEq,
+    ast.Name, ast.Load, ast.Constant, ast.Call,
+)
+
+class _Vectorize(ast.NodeTransformer):
+    """and/or/not/链式比较 -> 逐元素的 &/|/~，使表达式可直接作用于数组"""
+    def visit_BoolOp(self, node):
+        self.generic_visit(node)
+        op = ast.BitAnd() if isinstance(node.op, ast.And) else ast.BitOr()
+        expr = node.values[0]
+        for v in node.values[1:]:
+            expr = ast.BinOp(left=expr, op=op, right=v)
+        return expr
+
+    def visit_UnaryOp(self, node):
+        self.generic_visit(node)
+        if isinstance(node.op, ast.Not):
+            return ast.UnaryOp(op=ast.Invert(), operand=node.operand)
+        return node
+
+    def visit_Compare(self, node):
+        self.generic_visit(node)
+        parts, left = [], node.left
+        for op, right in zip(node.ops, node.comparators):
+            parts.append(ast.Compare(left=left, ops=[op], comparators=[right]))
+            left = right
+        expr = parts[0]
+        for p in parts[1:]:
+            expr = ast.BinOp(left=expr, op=ast.BitAnd(), right=p)
+        return expr
+
+class CompiledExpr:
+    """校验并编译后的表达式"""
+    def __init__(self, text):
+        self.text = str(text)
+        tree = ast.parse(self.text, mode='eval')
+        self.names, self.funcs = set(), set()
+        for node in ast.walk(tree):
+            if not isinstance(node, _ALLOWED_NODES):
+                raise ValueError(f"表达式不支持的语法 {type(node).__name__}: {self.text}")
+            if isinstance(node, ast.Call):
+                if not isinstance(node.func, ast.Name) or node.func.id not in NUMPY_FUNCS or node.keywords:
+                    raise ValueError(f"表达式不支持的函数调用: {self.text}")
+                self.funcs.add(node.func.id)
+            elif isinstance(node, ast.Name):
+                self.names.add(node.id)
+            elif isinstance(node, ast.Constant) and not isinstance(node.value, (int, float, bool)):
+                raise ValueError(f"表达式只支持数值常量: {self.text}")
+        self.names -= self.funcs
+        tree = ast.fix_missing_locations(_Vectorize().visit(tree))
+        self.code = compile(tree, f"<strategy: {self.text}>", 'eval')
+        self.numexpr_text = ast.unparse(tree) if HAS_NUMEXPR and self.funcs <= NUMEXPR_FUNCS else None
+
+    def evaluate(self, cols):
+        missing = self.names - set(cols)
+        if missing:
+            raise KeyError(f"表达式引用了不存在的列 {sorted(missing)}: {self.text}")
+        local = {k: cols[k] for k in self.names}
+        with np.errstate(invalid='ignore', divide='ignore'):
+            if self.numexpr_text is not None:
+                try:
+                    import numexpr
+                    return numexpr.evaluate(self.numexpr_text, local_dict=local)
+                except Exception:
+                    pass
+            return eval(self.code, {"__builtins__": {}, **NUMPY_FUNCS}, local)
+
+class Rule:
+    def __init__(self, spec):
+        self.when = CompiledExpr(spec["when"])
+        self.score = CompiledExpr(spec.get("score", "100"))
+        self.reason = spec.get("reason", "")
+        self.reason_fields = [f for _, f, _, _ in string.Formatter().parse(self.reason) if f]
+
+class Strategy:
+    def __init__(self, spec):
+        self.name = spec["name"]
+        self.label = spec.get("label", self.name)
+        self.scan = spec.get("scan", True)
+        self.rules = [Rule(r) for r in spec.get("rules", [])]
+
+    def evaluate(self, cols, symbols, with_reason=True):
+        """
+        cols 中各数组形状一致（一维：每股一个值；二维：symbols × dates）
+        返回 (mask, score, reason)，reason 为与 mask 同形状的字符串数组（with_reason=False 时为 None）
+        """
+        shape = cols['close'].shape
+        symbols = np.asarray(symbols, dtype=str)
+        if len(shape) == 2:
+            symbols = symbols[:, None]
+        cols = dict(cols)
+        cols['is_main'] = np.char.startswith(symbols, '60') | np.char.startswith(symbols, '00')
+        cols['is_gem'] = np.char.startswith(symbols, '30') | np.char.startswith(symbols, '68')
+
+        score = np.zeros(shape)
+        matched = np.zeros(shape, dtype=bool)
+        rule_idx = np.full(shape, -1, dtype='int16')
+        for i, rule in enumerate(self.rules):
+            hit = np.broadcast_to(rule.when.evaluate(cols), shape) & ~matched
+            if not hit.any(): continue
+            rule_score = np.nan_to_num(np.broadcast_to(rule.score.evaluate(cols), shape).astype('float64'))
+            score = np.where(hit, rule_score, score)
+            rule_idx[hit] = i
+            matched |= hit
+        mask = matched & (score > 0)
+
+        reason = None
+        if with_reason:
+            reason = np.full(shape, "", dtype=object)
+            for i, rule in enumerate(self.rules):
+                if not rule.reason_fields:
+                    reason[mask & (rule_idx == i)] = rule.reason
+                    continue
+                for idx in zip(*np.nonzero(mask & (rule_idx == i))):
+                    reason[idx] = rule.reason.format(**{f: np.broadcast_to(cols[f], shape)[idx] for f in rule.reason_fields})
+        return mask, score, reason
+
+_user_config = config_service.JsonConfig(STRATEGY_FILE, {"strategies": []})
+_compiled = {} # name -> (定义 JSON, Strategy)，定义未变时复用已编译的策略
+_compiled_lock = threading.Lock()
+
+def strategy_specs():
+    """内置策略 + data/strategies.json 中的策略（同名覆盖内置），保持定义顺序"""
+    specs = {s["name"]: s for s in BUILTIN_STRATEGIES}
+    for s in _user_config.get().get("strategies", []):
+        if s.get("enabled", True): specs[s["name"]] = s
+        else: specs.pop(s["name"], None)
+    return list(specs.values())
+
+def get_strategy(name):
+    spec = next((s for s in strategy_specs() if s["name"] == name), None)
+    if spec is None:
+        raise KeyError(f"未知策略: {name}")
+    key = json.dumps(spec, sort_keys=True, ensure_ascii=False)
+    with _compiled_lock:
+        cached = _compiled.get(name)
+        if cached is None or cached[0] != key:
+            cached = _compiled[name] = (key, Strategy(spec))
+        return cached[1]
+
+def list_strategies(scan_only=False):
+    """返回 [(name, label)]，scan_only=True 时只返回收盘扫描使用的策略"""
+    return [(s["name"], s.get("label", s["name"])) for s in strategy_specs() if not scan_only or s.get("scan", True)]
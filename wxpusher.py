@@ -1,6 +1,7 @@
 import requests
 import json
 import data_manager
+import metrics
 
 def send_wechat_msg(title, content):
     setting = data_manager.load_settings()
@@ -16,7 +17,9 @@ def send_wechat_msg(title, content):
         "contentType": 1,
         "uids": YOUR_UID
     }
-    response = requests.post(url, json=data)
+    metrics.incr("wxpusher.sent")
+    with metrics.span("wxpusher.send"):
+        response = requests.post(url, json=data)
     return response.json()
 
 # 在脚本最后添加